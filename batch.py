@@ -0,0 +1,138 @@
+# Batch simulation runner
+#
+#   python batch.py [map_file] [--runs N] [--seed S] [--ticks N] [--workers N] [--scripts scripts.json] [-o results.jsonl]
+#
+# Plays many headless PlayScenes across a process pool (one pygame context per
+# worker) and writes one JSON line per run: gems collected, health, mobs killed,
+# ticks to finish (collecting every gem) or to run out of input, and the error
+# if the run crashed. Each run plays a random script made from its seed, or
+# with --scripts, the scripts in a JSON list of [[ticks, [keys]], ...] scripts
+# in turn. The total simulations per second is printed to stderr at the end.
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+MOVES = [[zelda.CONTROLS['up']],
+         [zelda.CONTROLS['right']],
+         [zelda.CONTROLS['down']],
+         [zelda.CONTROLS['left']],
+         []]
+
+ACTIONS = [[], [], [zelda.pygame.K_g], [zelda.pygame.K_h]]
+
+
+def random_script(seed, segments=40):
+    rng = random.Random(seed)
+    script = []
+
+    for _ in range(segments):
+        keys = rng.choice(MOVES) + rng.choice(ACTIONS)
+        script.append([rng.randint(10, 120), keys])
+
+    return script
+
+def init_worker():
+    zelda.open_window()
+
+    # the game prints as it goes, which would get mixed into the results
+    sys.stdout = open(os.devnull, 'w')
+
+def run(job):
+    map_file, seed, script, max_ticks = job
+    start = time.perf_counter()
+
+    scene = zelda.PlayScene(map_file, streaming=False)
+    game = zelda.Game(scene, clock=zelda.SimClock(), input_source=zelda.ScriptedInput(script), render=False)
+
+    player = scene.player
+    mobs = len(scene.mobs)
+    gems = sum(isinstance(item, zelda.Gem) for item in scene.items)
+    finished = False
+
+    error = None
+
+    try:
+        while game.ticks < max_ticks and game.active_scene is scene and game.step():
+            if player.gems >= gems:
+                finished = True
+                break
+    except Exception as e:
+        # a crash is an outcome too, and shouldn't take the rest of the batch down with it
+        error = repr(e)
+
+    return {'seed': seed,
+            'gems': player.gems,
+            'health': player.health,
+            'mobs_killed': mobs - len(scene.mobs),
+            'ticks': game.ticks,
+            'finished': finished,
+            'error': error,
+            'seconds': round(time.perf_counter() - start, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many headless playthroughs in parallel.')
+    parser.add_argument('map_file', nargs='?', default=zelda.MAP_FILE)
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--scripts')
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args()
+
+    scripts = None
+
+    if args.scripts:
+        with open(args.scripts) as f:
+            scripts = json.load(f)
+
+    jobs = []
+
+    for i in range(args.runs):
+        seed = args.seed + i
+
+        if scripts:
+            script = scripts[i % len(scripts)]
+        else:
+            script = random_script(seed)
+
+        jobs.append((args.map_file, seed, script, args.ticks))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    start = time.perf_counter()
+
+    # spawn rather than fork, so each worker starts its own pygame instead of inheriting the parent's
+    context = multiprocessing.get_context('spawn')
+
+    pool = context.Pool(args.workers, initializer=init_worker)
+
+    try:
+        for result in pool.imap_unordered(run, jobs, chunksize=max(1, args.runs // (args.workers * 8))):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        # SDL catches SIGTERM in the workers, so let them finish instead of terminating the pool
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+
+    if out is not sys.stdout:
+        out.close()
+
+    print(f'{args.runs} runs on {args.workers} workers in {elapsed:.1f}s: {args.runs / elapsed:.1f} sims/s', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
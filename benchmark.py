@@ -0,0 +1,57 @@
+# Headless throughput benchmark
+#
+#   python benchmark.py [map_file] [--ticks N] [--profile trace.json]
+#
+# Runs a PlayScene on a simulated clock with scripted input and reports
+# how many ticks per second the simulation manages, with and without rendering.
+# With --profile, the update + render run is also profiled per phase and
+# written out as a Chrome trace (open it in chrome://tracing or Perfetto).
+
+import argparse
+import os
+import time
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+def measure(map_file, ticks, render):
+    scene = zelda.PlayScene(map_file)
+    inputs = zelda.ScriptedInput(zelda.WALK_SCRIPT, loop=True)
+    game = zelda.Game(scene, clock=zelda.SimClock(), input_source=inputs, render=render)
+
+    start = time.perf_counter()
+    done = game.run(max_ticks=ticks)
+    elapsed = time.perf_counter() - start
+
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure headless simulation throughput.')
+    parser.add_argument('map_file', nargs='?', default=zelda.MAP_FILE)
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--profile', metavar='TRACE_FILE')
+    args = parser.parse_args()
+
+    update_tps = measure(args.map_file, args.ticks, render=False)
+
+    zelda.profiler.enabled = args.profile is not None
+    render_tps = measure(args.map_file, args.ticks, render=True)
+
+    print(f'{args.map_file}: {args.ticks} ticks')
+    print(f'  update only:     {update_tps:10.1f} ticks/s')
+    print(f'  update + render: {render_tps:10.1f} ticks/s')
+
+    if args.profile:
+        zelda.profiler.export(args.profile)
+        print()
+        print('  phase              p50      p95      p99  (ms, or count per frame)')
+
+        for line in zelda.profiler.summary():
+            print('  ' + line)
+
+
+if __name__ == "__main__":
+    main()
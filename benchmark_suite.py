@@ -0,0 +1,259 @@
+# Performance regression suite
+#
+#   python benchmark_suite.py [--sizes small medium large] [--baseline FILE] [--threshold 0.3] [--save]
+#
+# Times the hot paths (Map.load, Player.move collision, Monster.update,
+# PlayScene.update and PlayScene.render) on generated maps of growing size and
+# compares each against benchmark_baseline.json. Every time is divided by a fixed
+# calibration workload timed in turns with it, so the comparison follows the code
+# rather than how fast (or how busy) the machine is at the moment. Exits non-zero
+# if anything got slower than the baseline by more than the threshold (a fraction,
+# so 0.25 is 25%). A benchmark whose rounds disagree among themselves more than
+# that gets a wider threshold, as does one listed in THRESHOLDS. --save writes the
+# results as the new baseline; commit it along with changes that move it.
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+import mapgen
+import pygame
+
+
+# rooms per side, and entities per room
+SIZES = {'small': 4, 'medium': 16, 'large': 48}
+GEMS_PER_ROOM = 3
+POTIONS_PER_ROOM = 1
+MONSTERS_PER_ROOM = 2
+WALL_RATIO = 0.1
+
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# every round runs for at least MIN_ROUND_TIME seconds, so sub-millisecond calls are timed many times over
+ROUNDS = 25
+MIN_ROUND_TIME = 0.05
+
+# a change only counts once it is NOISE_MARGIN times the spread between rounds, so noisy benchmarks don't cry wolf
+NOISE_MARGIN = 2
+
+# benchmarks the calibration follows less closely than --threshold allows. Map.load is mostly file reading
+# and NumPy, which don't speed up and slow down with the machine the way the calibration's Python does.
+THRESHOLDS = {'map_load': 0.6}
+
+CALIBRATION_RECTS = [pygame.Rect(i * 37 % zelda.WIDTH, i * 53 % zelda.HEIGHT, 32, 32) for i in range(500)]
+
+
+def calls_per_round(fn, min_time):
+    ''' Like timeit's autorange: doubles the number of calls until they take min_time. '''
+    number = 1
+
+    while True:
+        start = time.perf_counter()
+
+        for _ in range(number):
+            fn()
+
+        if time.perf_counter() - start >= min_time:
+            return number
+
+        number *= 2
+
+def round_times(fns, rounds=ROUNDS, min_time=MIN_ROUND_TIME):
+    ''' Seconds per call of each function, one list per function with a time for every round. The
+        functions take turns round by round, so a slow spell on the machine hits all of them alike.
+        Like timeit, the garbage collector is off while timing. '''
+    times = [[] for _ in fns]
+    gc.collect()
+    gc.disable()
+
+    try:
+        numbers = [calls_per_round(fn, min_time) for fn in fns]
+
+        for _ in range(rounds):
+            for i, (fn, number) in enumerate(zip(fns, numbers)):
+                start = time.perf_counter()
+
+                for _ in range(number):
+                    fn()
+
+                times[i].append((time.perf_counter() - start) / number)
+    finally:
+        gc.enable()
+
+    return times
+
+def relative_time(unit_times, times):
+    ''' The median of times over unit_times, round by round, and how far apart the middle half of
+        those ratios are, as a fraction of the median. '''
+    ratios = sorted(seconds / unit for unit, seconds in zip(unit_times, times))
+    quarter = len(ratios) // 4
+    median = ratios[len(ratios) // 2]
+
+    return median, (ratios[-1 - quarter] - ratios[quarter]) / median
+
+def calibration():
+    ''' A fixed mix of the kind of work the game does: rect tests, and dict and list churn. '''
+    target = pygame.Rect(400, 300, 128, 128)
+    hits = {}
+
+    for rect in CALIBRATION_RECTS:
+        if rect.colliderect(target):
+            hits[rect.topleft] = rect
+
+    return sorted(hits)
+
+# Each benchmark sets up around a map file and yields the function to time, then puts back anything it changed
+@contextlib.contextmanager
+def bench_map_load(path):
+    def load():
+        zelda.map_templates.clear()
+        zelda.Map(path)
+
+    yield load
+
+@contextlib.contextmanager
+def bench_player_move(path):
+    world = zelda.Map(path)
+    player = world.player
+    speeds = [(zelda.PLAYER_SPEED, 0), (0, zelda.PLAYER_SPEED), (-zelda.PLAYER_SPEED, 0), (0, -zelda.PLAYER_SPEED)]
+    steps = [0]
+
+    def move():
+        # walk in a square that keeps running into the walls around the start
+        player.vx, player.vy = speeds[steps[0] // 60 % 4]
+        player.move(world)
+        steps[0] += 1
+
+    yield move
+
+@contextlib.contextmanager
+def bench_monster_update(path):
+    world = zelda.Map(path)
+    mobs = world.mobs.sprites()
+
+    # monsters only chase a player in their own room, so bring them all into the player's, furthest cells first
+    col = world.player.rect.centerx // zelda.GRID_SIZE // zelda.ROOM_COLS * zelda.ROOM_COLS
+    row = world.player.rect.centery // zelda.GRID_SIZE // zelda.ROOM_ROWS * zelda.ROOM_ROWS
+    cells = [(c, r) for r in range(row, row + zelda.ROOM_ROWS) for c in range(col, col + zelda.ROOM_COLS) if not world.is_solid(c, r)]
+    cells.sort(key=lambda cell: -abs(cell[0] * zelda.GRID_SIZE - world.player.rect.centerx) - abs(cell[1] * zelda.GRID_SIZE - world.player.rect.centery))
+
+    for i, mob in enumerate(mobs):
+        mob.rect.center = world.cell_center(*cells[i % len(cells)])
+
+    def update():
+        for mob in mobs:
+            mob.update(world)
+
+    chase = zelda.MONSTER_CHASE
+    zelda.MONSTER_CHASE = True
+
+    try:
+        yield update
+    finally:
+        zelda.MONSTER_CHASE = chase
+
+@contextlib.contextmanager
+def bench_scene_update(path):
+    scene = zelda.PlayScene(path)
+    inputs = zelda.ScriptedInput(zelda.WALK_SCRIPT, loop=True)
+
+    def update():
+        scene.process_input(*inputs.poll())
+        scene.update()
+
+    yield update
+
+@contextlib.contextmanager
+def bench_scene_render(path):
+    scene = zelda.PlayScene(path)
+
+    def render():
+        # always a full redraw, the worst case
+        scene.drawn_offset = None
+        scene.render()
+
+    yield render
+
+BENCHMARKS = [('map_load', bench_map_load),
+              ('player_move', bench_player_move),
+              ('monster_update', bench_monster_update),
+              ('scene_update', bench_scene_update),
+              ('scene_render', bench_scene_render)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the hot paths and compare them with a baseline.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=0.3)
+    parser.add_argument('--save', action='store_true')
+    args = parser.parse_args()
+
+    zelda.open_window()
+
+    baseline = {}
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+
+    # relative is the time in units of the calibration workload, and noise the spread between rounds; the baseline stores both
+    print('  size     benchmark            ms/op    relative   noise    baseline    change   allowed')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            rooms = SIZES[size]
+            path = os.path.join(directory, f'{size}.txt')
+            mapgen.write_map(path, rooms, rooms, WALL_RATIO,
+                             GEMS_PER_ROOM * rooms * rooms, POTIONS_PER_ROOM * rooms * rooms, MONSTERS_PER_ROOM * rooms * rooms)
+
+            results[size] = {}
+
+            for name, bench in BENCHMARKS:
+                with bench(path) as fn:
+                    unit_times, times = round_times([calibration, fn])
+
+                relative, noise = relative_time(unit_times, times)
+                results[size][name] = {'relative': relative, 'noise': noise}
+                base = baseline.get(size, {}).get(name)
+                line = f'  {size:8} {name:16} {min(times) * 1000:10.4f} {relative:11.2f} {noise:7.1%}'
+
+                if base is None:
+                    print(line + '           -')
+                    continue
+
+                change = relative / base['relative'] - 1
+                allowed = max(args.threshold, THRESHOLDS.get(name, 0), NOISE_MARGIN * max(noise, base['noise']))
+                flag = ''
+
+                if change > allowed:
+                    flag = '  REGRESSION'
+                    regressions.append(f'{size}/{name}')
+
+                print(line + f' {base["relative"]:11.2f} {change:+9.1%} {allowed:9.0%}{flag}')
+
+    if args.save:
+        baseline.update(results)
+
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+
+        print(f'baseline saved to {args.baseline}')
+    elif regressions:
+        print(f'{len(regressions)} over their threshold: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
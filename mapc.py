@@ -0,0 +1,31 @@
+# Map compiler
+#
+#   python mapc.py maps/map1.txt [-o maps/map1.zmap]
+#
+# Converts a text map (W, G, H, S, B, M, P symbols) into the compiled .zmap
+# format, which Map loads by memory-mapping instead of parsing.
+
+import argparse
+import os
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile a text map into a .zmap file.')
+    parser.add_argument('src')
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args()
+
+    dst = args.output or os.path.splitext(args.src)[0] + '.zmap'
+    zelda.compile_map(args.src, dst)
+
+    data = zelda.read_compiled_map(dst)
+    rows, cols = data.tiles.shape
+    print(f'{args.src} -> {dst}: {cols}x{rows} tiles, {len(data.entities)} entities')
+
+
+if __name__ == "__main__":
+    main()
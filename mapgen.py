@@ -0,0 +1,84 @@
+# Map generator
+#
+#   python mapgen.py out.txt [--rooms COLS ROWS] [--walls RATIO] [--gems N] [--potions N] [--monsters N] [--seed S]
+#
+# Writes a text map (same symbols as maps/map1.txt) of any size for testing and
+# benchmarking. Every room has a wall around it with a door in the middle of
+# each side, and a clear cross between its doors so the whole map stays
+# connected. The rest of each room is walled at random with the given ratio.
+# Gems, potions and monsters go in random open cells. The terrain only depends
+# on the size, wall ratio and seed, so maps that differ only in entities line up.
+
+import argparse
+import os
+
+import numpy as np
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+def generate_map(room_cols, room_rows, wall_ratio=0.1, gems=0, potions=0, monsters=0, seed=0):
+    ''' The text of a map room_cols by room_rows rooms in size. '''
+    cols = room_cols * zelda.ROOM_COLS
+    rows = room_rows * zelda.ROOM_ROWS
+
+    x = np.arange(cols) % zelda.ROOM_COLS
+    y = np.arange(rows) % zelda.ROOM_ROWS
+
+    edge = (np.isin(x, [0, zelda.ROOM_COLS - 1])[None, :]) | (np.isin(y, [0, zelda.ROOM_ROWS - 1])[:, None])
+    lane = (x == zelda.ROOM_COLS // 2)[None, :] | (y == zelda.ROOM_ROWS // 2)[:, None]
+
+    outside = np.zeros((rows, cols), bool)
+    outside[[0, -1], :] = True
+    outside[:, [0, -1]] = True
+
+    terrain = np.random.default_rng(seed)
+    walls = (edge & (~lane | outside)) | (~edge & ~lane & (terrain.random((rows, cols)) < wall_ratio))
+
+    grid = np.full((rows, cols), ord(' '), np.uint8)
+    grid[walls] = ord('W')
+
+    player_col = room_cols // 2 * zelda.ROOM_COLS + zelda.ROOM_COLS // 2
+    player_row = room_rows // 2 * zelda.ROOM_ROWS + zelda.ROOM_ROWS // 2
+    grid[player_row, player_col] = ord('P')
+
+    open_cells = np.flatnonzero(grid == ord(' '))
+    count = gems + potions + monsters
+
+    if count > len(open_cells):
+        raise ValueError(f'only {len(open_cells)} open cells for {count} entities')
+
+    # a separate generator, so the entity counts don't change the terrain
+    cells = np.random.default_rng([seed, 1]).choice(open_cells, count, replace=False)
+    grid.flat[cells[:gems]] = ord('G')
+    grid.flat[cells[gems:gems + potions]] = ord('H')
+    grid.flat[cells[gems + potions:]] = ord('M')
+
+    return '\n'.join(row.tobytes().decode('ascii') for row in grid)
+
+def write_map(path, *args, **kwargs):
+    with open(path, 'w') as f:
+        f.write(generate_map(*args, **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a map of any size.')
+    parser.add_argument('output')
+    parser.add_argument('--rooms', type=int, nargs=2, default=[8, 8], metavar=('COLS', 'ROWS'))
+    parser.add_argument('--walls', type=float, default=0.1)
+    parser.add_argument('--gems', type=int, default=0)
+    parser.add_argument('--potions', type=int, default=0)
+    parser.add_argument('--monsters', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_map(args.output, args.rooms[0], args.rooms[1], args.walls, args.gems, args.potions, args.monsters, args.seed)
+
+    cols, rows = args.rooms
+    print(f'{args.output}: {cols}x{rows} rooms, {args.gems} gems, {args.potions} potions, {args.monsters} monsters')
+
+
+if __name__ == "__main__":
+    main()
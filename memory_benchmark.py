@@ -0,0 +1,87 @@
+# Map memory benchmark
+#
+#   python memory_benchmark.py [--sizes 2 4 8] [--max-cell-bytes N] [--max-entity-bytes N]
+#
+# Generates square worlds of growing size (measured in rooms per side) and
+# reports how much memory Map allocates per tile cell and per static entity
+# (gems and potions). With the --max-* options it exits non-zero if either
+# figure goes over the limit, so it can be used to catch regressions.
+
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+import mapgen
+
+
+# per room, about half of the open cells
+GEMS_PER_ROOM = 36
+POTIONS_PER_ROOM = 18
+
+
+def allocated(path):
+    ''' Bytes still held by a freshly loaded Map, counted while it is alive. '''
+    tracemalloc.start()
+    world = zelda.Map(path)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(world.items)
+    world.close()
+
+    return size, count
+
+def measure(directory, rooms):
+    paths = []
+
+    for items in (False, True):
+        path = os.path.join(directory, f'rooms{rooms}_{int(items)}.txt')
+        count = rooms * rooms if items else 0
+        mapgen.write_map(path, rooms, rooms, 0, GEMS_PER_ROOM * count, POTIONS_PER_ROOM * count)
+        paths.append(path)
+
+    terrain, _ = allocated(paths[0])
+    full, count = allocated(paths[1])
+    cells = rooms * zelda.ROOM_COLS * rooms * zelda.ROOM_ROWS
+
+    return cells, count, terrain / cells, (full - terrain) / max(count, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure Map memory per cell and per entity.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--max-cell-bytes', type=float)
+    parser.add_argument('--max-entity-bytes', type=float)
+    args = parser.parse_args()
+
+    zelda.open_window()
+    failed = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        # load once so the shared images and sounds are already cached
+        measure(directory, 1)
+
+        print('  rooms     cells  entities   bytes/cell  bytes/entity')
+
+        for rooms in args.sizes:
+            cells, count, cell_bytes, entity_bytes = measure(directory, rooms)
+            print(f'  {rooms:>3}x{rooms:<3} {cells:7} {count:9} {cell_bytes:12.1f} {entity_bytes:13.1f}')
+
+            if args.max_cell_bytes is not None and cell_bytes > args.max_cell_bytes:
+                failed = True
+
+            if args.max_entity_bytes is not None and entity_bytes > args.max_entity_bytes:
+                failed = True
+
+    if failed:
+        print('memory threshold exceeded')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
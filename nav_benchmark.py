@@ -0,0 +1,90 @@
+# Monster navigation benchmark
+#
+#   python nav_benchmark.py [--monsters 1 10 25 50 90] [--ticks N]
+#
+# Fills one room with N monsters chasing the player (who walks in a small loop,
+# so the flow field is rebuilt every time they change cells) and reports update
+# ticks per second and the cost per monster, against the same room with
+# chasing turned off.
+
+import argparse
+import os
+import tempfile
+import time
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+C = zelda.CONTROLS
+LOOP_SCRIPT = [[30, [C['right']]], [30, [C['down']]], [30, [C['left']]], [30, [C['up']]]]
+
+
+def generate_room(monsters):
+    ''' A walled room with a few pillars, the player in the middle and monsters in the open cells around them. '''
+    rows = [[' '] * zelda.ROOM_COLS for _ in range(zelda.ROOM_ROWS)]
+
+    for row in range(zelda.ROOM_ROWS):
+        for col in range(zelda.ROOM_COLS):
+            edge = col in (0, zelda.ROOM_COLS - 1) or row in (0, zelda.ROOM_ROWS - 1)
+            pillar = col % 4 == 2 and row % 3 == 2
+
+            if edge or pillar:
+                rows[row][col] = 'W'
+
+    player = (zelda.ROOM_COLS // 2, zelda.ROOM_ROWS // 2)
+    rows[player[1]][player[0]] = 'P'
+
+    # furthest cells first, so the monsters have somewhere to walk
+    open_cells = [(col, row) for row in range(zelda.ROOM_ROWS) for col in range(zelda.ROOM_COLS) if rows[row][col] == ' ']
+    open_cells.sort(key=lambda cell: -abs(cell[0] - player[0]) - abs(cell[1] - player[1]))
+
+    if monsters > len(open_cells):
+        raise ValueError(f'a room only has room for {len(open_cells)} monsters')
+
+    for col, row in open_cells[:monsters]:
+        rows[row][col] = 'M'
+
+    return '\n'.join(''.join(row) for row in rows)
+
+def measure(map_file, ticks, chase):
+    zelda.MONSTER_CHASE = chase
+
+    scene = zelda.PlayScene(map_file)
+    inputs = zelda.ScriptedInput(LOOP_SCRIPT, loop=True)
+    game = zelda.Game(scene, clock=zelda.SimClock(), input_source=inputs, render=False)
+
+    start = time.perf_counter()
+    done = game.run(max_ticks=ticks)
+    elapsed = time.perf_counter() - start
+
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure monster navigation cost per room.')
+    parser.add_argument('--monsters', type=int, nargs='+', default=[1, 10, 25, 50, 90])
+    parser.add_argument('--ticks', type=int, default=2000)
+    args = parser.parse_args()
+
+    zelda.open_window()
+
+    print('  monsters    idle ticks/s   chasing ticks/s   us/monster/tick')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for monsters in args.monsters:
+            path = os.path.join(directory, f'room{monsters}.txt')
+
+            with open(path, 'w') as f:
+                f.write(generate_room(monsters))
+
+            idle_tps = measure(path, args.ticks, chase=False)
+            chase_tps = measure(path, args.ticks, chase=True)
+            per_monster = (1 / chase_tps - 1 / idle_tps) / monsters * 1000000
+
+            print(f'  {monsters:8} {idle_tps:15.1f} {chase_tps:17.1f} {per_monster:17.2f}')
+
+
+if __name__ == "__main__":
+    main()
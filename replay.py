@@ -0,0 +1,54 @@
+# Input replay
+#
+#   python replay.py session.zrec [--render] [--profile trace.json]
+#
+# Plays back a recording made with ZELDA_RECORD=session.zrec as fast as the
+# simulation can go (no frame limiting), optionally rendering every frame.
+# The summary at the end (and, when rendering, a hash of the last frame) is
+# the same on every run, so it can be checked against a known good output.
+
+import argparse
+import hashlib
+import os
+import time
+
+os.environ['ZELDA_HEADLESS'] = '1'
+
+import zelda
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded session at full speed.')
+    parser.add_argument('recording')
+    parser.add_argument('--render', action='store_true')
+    parser.add_argument('--profile', metavar='TRACE_FILE')
+    args = parser.parse_args()
+
+    zelda.profiler.enabled = args.profile is not None
+
+    replay = zelda.InputReplay(args.recording)
+    game = zelda.Game(clock=zelda.SimClock(), input_source=replay, render=args.render)
+
+    start = time.perf_counter()
+    done = game.run()
+    elapsed = time.perf_counter() - start
+
+    print(f'{args.recording}: {done} of {replay.length} ticks in {elapsed:.2f}s ({done / elapsed:.1f} ticks/s)')
+
+    scene = game.active_scene
+
+    if isinstance(scene, zelda.PlayScene):
+        print(f'  scene: PlayScene, player at {tuple(scene.player.rect)}, gems {scene.player.gems}, health {scene.player.health}')
+    else:
+        print(f'  scene: {type(scene).__name__}')
+
+    if args.render:
+        frame = hashlib.sha1(zelda.pygame.image.tostring(zelda.screen, 'RGB')).hexdigest()
+        print(f'  last frame: {frame}')
+
+    if args.profile:
+        zelda.profiler.export(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,24 @@
 # Imports
+import glob
+import hashlib
+import json
 import math
+import mmap
+import numpy as np
+import os
 import pygame
+import queue
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Headless mode (no real window or sound card, e.g. on build boxes)
+HEADLESS = os.environ.get('ZELDA_HEADLESS') == '1'
+
+if HEADLESS:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
 
 # Initialize game engine
 pygame.init()
@@ -13,12 +31,14 @@ HEIGHT = 10 * GRID_SIZE
 TITLE = "Zelda-ish"
 SUBTITLE = "Link to the Legends of the Time of the Wild Past"
 FPS = 60
+RENDER_FPS = 60
 
 HUD_HEIGHT = 96
 
 # Colors
 WHITE = (255, 255, 255)
 LIGHT_GRAY = (200, 200, 200)
+DARK_GRAY = (50, 50, 50)
 BLACK = (0, 0, 0)
 DARK_GREEN = (0, 125, 0)
 LIME_GREEN = (150, 255, 100)
@@ -41,13 +61,415 @@ CONTROLS = {'up': pygame.K_w,
 GEM_VALUE = 1
 HEALING_POTION_STRENGTH = 1
 
+# Characters show the next frame of their animation every ANIMATION_FRAME_TICKS ticks
+ANIMATION_FRAME_TICKS = 6
+
+# Monsters walk toward the player along each room's flow field when MONSTER_CHASE is on
+MONSTER_CHASE = False
+MONSTER_SPEED = 2
+
+# Monsters that missed updates (asleep in another room, or scheduled less often) make up at most this many ticks at once
+MONSTER_CATCH_UP_TICKS = 16
+
+# Monsters within MONSTER_NEAR_DISTANCE of the player update every tick like the player and weapons; the rest every
+# MONSTER_FAR_RATE ticks, as long as the updates for a rendered frame fit in UPDATE_BUDGET ms. Updates over the budget
+# wait for the next tick. The budget is wall-clock time, so only live play on the real clock has one; simulated clocks
+# and recorded sessions update everything that's due, so they play out the same on any machine.
+UPDATE_BUDGET = 4
+MONSTER_NEAR_DISTANCE = 5 * GRID_SIZE
+MONSTER_FAR_RATE = 4
+
+# Swings and thrown weapons share a fixed set of reusable slots
+PROJECTILE_SLOTS = 64
+SWORD_SWING_TICKS = 30
+BOOMERANG_THROW_TICKS = 120
+BOOMERANG_SPEED = 5
+
 ROOM_TRANSITION_SPEED = 16
+ROOM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ASSET_CACHE_DIR = '.cache/assets'
+TEXT_CACHE_SIZE = 256
+
+# Only redraw and flip the parts of the screen that changed (falls back to full redraws when the view scrolls)
+DIRTY_RECTS = True
+DIRTY_RECT_LIMIT = 32
+
+# 'sprites' resolves hits sprite by sprite; 'arrays' resolves them in batches with NumPy (better for crowded rooms)
+ENTITY_BACKEND = 'sprites'
+
+# Streaming worlds (rooms within STREAM_RADIUS, plus STREAM_LOOKAHEAD more in the direction of travel, are kept loaded)
+STREAM_WORLD = False
+STREAM_RADIUS = 1
+STREAM_LOOKAHEAD = 2
+STREAM_EVICT_RADIUS = 3
+
+# Loop settings (the simulation always steps at FPS; rendering runs at RENDER_FPS, 0 = uncapped)
+STEP_TIME = 1000000 // FPS
+MAX_STEPS_PER_FRAME = 5
+MAX_FRAME_SKIP = 4
+INTERPOLATE = False
+
+# Profiling (ZELDA_PROFILE=1 to record; F3 toggles the overlay while playing)
+PROFILE = os.environ.get('ZELDA_PROFILE') == '1'
+PROFILE_WINDOW = 300
+PROFILE_MAX_EVENTS = 200000
+PROFILE_TRACE_FILE = 'profile.json'
+
+# Scenes that are slow to build (the play scene) are built on a background thread while the one before is showing
+PRELOAD_SCENES = True
+SCENE_READY = pygame.event.custom_type()
+
+# Input recording (ZELDA_RECORD=session.zrec to record a session; replay.py plays it back)
+RECORD_FILE = os.environ.get('ZELDA_RECORD')
+RECORDED_KEYS = sorted(set(CONTROLS.values()) | {pygame.K_LCTRL, pygame.K_RCTRL, pygame.K_q})
+
+
+# Clocks and input (times are in microseconds)
+class GameClock():
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+
+    def tick(self, framerate=0):
+        return self.clock.tick(framerate)
+
+    def now(self):
+        return int(time.perf_counter() * 1000000)
+
+    def get_fps(self):
+        return self.clock.get_fps()
+
+
+class SimClock():
+    ''' Stands in for GameClock, but advances a fixed step per tick instead of sleeping. '''
+    def __init__(self, step=STEP_TIME):
+        self.step = step
+        self.time = 0
+
+    def tick(self, framerate=0):
+        self.time += self.step
+
+        return self.step // 1000
+
+    def now(self):
+        return self.time
+
+    def get_fps(self):
+        return 1000000 / self.step
+
+
+class KeyState():
+    ''' Indexable like the result of pygame.key.get_pressed(). '''
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+class ScriptedInput():
+    ''' Feeds a scene a script of [ticks, keys] segments, holding each set of keys for that many ticks. '''
+    def __init__(self, script, loop=False):
+        self.script = script
+        self.loop = loop
+        self.segment = 0
+        self.ticks_left = script[0][0] if script else 0
+        self.held = KeyState()
+
+    def poll(self):
+        while self.ticks_left <= 0:
+            self.segment += 1
+
+            if self.segment >= len(self.script):
+                if not self.loop or not self.script:
+                    return None
+
+                self.segment = 0
+
+            self.ticks_left = self.script[self.segment][0]
+
+        pressed = KeyState(self.script[self.segment][1])
+
+        # preloaded scenes announce themselves through the event queue, which scripted runs need too
+        events = pygame.event.get(SCENE_READY)
+
+        for key in sorted(pressed.keys - self.held.keys):
+            events.append(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+        for key in sorted(self.held.keys - pressed.keys):
+            events.append(pygame.event.Event(pygame.KEYUP, key=key))
+
+        self.held = pressed
+        self.ticks_left -= 1
+
+        return events, pressed
+
+
+WALK_SCRIPT = [[120, [CONTROLS['right']]],
+               [60, [CONTROLS['down']]],
+               [120, [CONTROLS['left']]],
+               [60, [CONTROLS['up']]],
+               [10, []]]
+
+
+# Input recording
+# A recording is a header, then one record per tick where the input changed: the ticks since the
+# previous record and how many entries follow, then the entries. An entry is a kind and a key.
+REPLAY_MAGIC = b'ZREC'
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct('<4sHxxI')
+REPLAY_RECORD = struct.Struct('<IH')
+REPLAY_ENTRY = struct.Struct('<BI')
+
+KEY_PRESSED = 0
+KEY_RELEASED = 1
+EVENT_KEYDOWN = 2
+EVENT_KEYUP = 3
+EVENT_QUIT = 4
+EVENT_SCENE_READY = 5
+
+EVENT_KINDS = {pygame.KEYDOWN: EVENT_KEYDOWN, pygame.KEYUP: EVENT_KEYUP, pygame.QUIT: EVENT_QUIT,
+               SCENE_READY: EVENT_SCENE_READY}
+EVENT_TYPES = {kind: event_type for event_type, kind in EVENT_KINDS.items()}
+
+
+class InputRecorder():
+    ''' Passes input through from a source (the keyboard if None) and writes what changed each tick to a file. '''
+    def __init__(self, path, source=None):
+        self.file = open(path, 'wb')
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, 0))
+        self.source = source
+        self.held = frozenset()
+        self.ticks = 0
+        self.last_record = 0
+
+    def read(self):
+        if self.source is not None:
+            return self.source.poll()
+
+        return pygame.event.get(), pygame.key.get_pressed()
+
+    def poll(self):
+        state = self.read()
+
+        if state is None:
+            return None
+
+        events, pressed = state
+        held = frozenset(key for key in RECORDED_KEYS if pressed[key])
+        entries = []
+
+        for key in sorted(held - self.held):
+            entries.append((KEY_PRESSED, key))
+
+        for key in sorted(self.held - held):
+            entries.append((KEY_RELEASED, key))
+
+        for event in events:
+            kind = EVENT_KINDS.get(event.type)
+
+            if kind is not None:
+                entries.append((kind, getattr(event, 'key', 0)))
+
+        if entries:
+            self.file.write(REPLAY_RECORD.pack(self.ticks - self.last_record, len(entries)))
+            self.file.write(b''.join(REPLAY_ENTRY.pack(kind, key) for kind, key in entries))
+            self.last_record = self.ticks
+
+        self.held = held
+        self.ticks += 1
+
+        return state
+
+    def close(self):
+        ''' Writes the tick count into the header so playback runs to the same length. '''
+        self.file.seek(0)
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.ticks))
+        self.file.close()
+
+
+class InputReplay():
+    ''' Feeds a scene the input from a recording, tick for tick. '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        magic, version, self.length = REPLAY_HEADER.unpack_from(data, 0)
+
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f'{path} is not a version {REPLAY_VERSION} input recording')
+
+        # tick -> entries, for the ticks where something changed
+        self.records = {}
+        offset = REPLAY_HEADER.size
+        tick = 0
+
+        while offset < len(data):
+            delta, count = REPLAY_RECORD.unpack_from(data, offset)
+            offset += REPLAY_RECORD.size
+            tick += delta
+
+            self.records[tick] = list(REPLAY_ENTRY.iter_unpack(data[offset:offset + count * REPLAY_ENTRY.size]))
+            offset += count * REPLAY_ENTRY.size
+
+        # a recording that was never closed (e.g. the game crashed) just plays until its last change
+        if self.length == 0 and self.records:
+            self.length = tick + 1
+
+        self.ticks = 0
+        self.held = KeyState()
+
+    def poll(self):
+        if self.ticks >= self.length:
+            return None
 
+        events = []
+        keys = set(self.held.keys)
 
-# Make the window
-screen = pygame.display.set_mode([WIDTH, HEIGHT + HUD_HEIGHT])
-pygame.display.set_caption(TITLE)
-clock = pygame.time.Clock()
+        for kind, key in self.records.get(self.ticks, []):
+            if kind == KEY_PRESSED:
+                keys.add(key)
+            elif kind == KEY_RELEASED:
+                keys.discard(key)
+            elif kind in (EVENT_QUIT, EVENT_SCENE_READY):
+                events.append(pygame.event.Event(EVENT_TYPES[kind]))
+            else:
+                events.append(pygame.event.Event(EVENT_TYPES[kind], key=key))
+
+        if keys != self.held.keys:
+            self.held = KeyState(keys)
+
+        self.ticks += 1
+
+        return events, self.held
+
+
+# Profiling
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Span():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler():
+    ''' Times named spans per frame and keeps rolling p50/p95/p99s, per-frame counters and
+        Chrome trace events. When disabled, span() hands back a shared no-op span. Spans on other
+        threads (chunk loading, preloading) aren't part of any frame, so each one is a sample of its own. '''
+    NULL_SPAN = NullSpan()
+
+    def __init__(self, enabled=False, window=PROFILE_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.show_overlay = False
+        self.origin = time.perf_counter()
+        self.frames = 0
+        self.frame = {}
+        self.samples = {}
+        self.events = deque(maxlen=PROFILE_MAX_EVENTS)
+        self.lock = threading.RLock()
+
+    def span(self, name):
+        if not self.enabled:
+            return self.NULL_SPAN
+
+        return Span(self, name)
+
+    def add(self, name, value):
+        with self.lock:
+            if threading.current_thread() is threading.main_thread():
+                self.frame[name] = self.frame.get(name, 0) + value
+            else:
+                self.add_sample(name, value)
+
+    def add_sample(self, name, value):
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.window)
+
+        self.samples[name].append(value)
+
+    def record(self, name, start, end):
+        self.add(name, (end - start) * 1000)
+        self.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': threading.get_ident(),
+                            'ts': (start - self.origin) * 1000000, 'dur': (end - start) * 1000000})
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.add(name, n)
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            for name, value in self.frame.items():
+                self.add_sample(name, value)
+
+            self.frame = {}
+
+        self.events.append({'name': 'frame', 'ph': 'i', 's': 'g', 'pid': 0, 'tid': threading.get_ident(),
+                            'ts': (time.perf_counter() - self.origin) * 1000000})
+        self.frames += 1
+
+    def percentiles(self, name):
+        with self.lock:
+            values = sorted(self.samples.get(name, []))
+
+        if not values:
+            return 0, 0, 0
+
+        last = len(values) - 1
+
+        return values[last * 50 // 100], values[last * 95 // 100], values[last * 99 // 100]
+
+    def summary(self):
+        ''' One line per span or counter: name, p50, p95, p99. '''
+        lines = []
+
+        with self.lock:
+            names = sorted(self.samples)
+
+        for name in names:
+            p50, p95, p99 = self.percentiles(name)
+            lines.append(f'{name:<16} {p50:8.2f} {p95:8.2f} {p99:8.2f}')
+
+        return lines
+
+    def export(self, path=PROFILE_TRACE_FILE):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, f)
+
+
+profiler = Profiler(PROFILE)
+
+
+# Make the window (on first use, so importing the module stays cheap)
+screen = None
+clock = GameClock()
+
+def open_window():
+    global screen
+
+    if screen is None:
+        screen = pygame.display.set_mode([WIDTH, HEIGHT + HUD_HEIGHT])
+        pygame.display.set_caption(TITLE)
+
+    return screen
 
 
 # Utility functions
@@ -86,9 +508,37 @@ def unpause_music():
 def stop_music(fadeout_time=0):
     pygame.mixer.music.fadeout(fadeout_time)
 
+class TextCache():
+    ''' LRU of rendered text surfaces, so unchanged strings are only rasterized once. '''
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+
+        # scenes being preloaded draw text too, and fonts can't render on two threads at once
+        self.lock = threading.Lock()
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, tuple(color), antialias)
+
+        with self.lock:
+            surface = self.surfaces.get(key)
+
+            if surface is not None:
+                self.surfaces.move_to_end(key)
+            else:
+                surface = font.render(text, antialias, color)
+                self.surfaces[key] = surface
+
+                if len(self.surfaces) > self.size:
+                    self.surfaces.popitem(last=False)
+
+        return surface
+
+text_cache = TextCache()
+
 def draw_text(surface, text, font, color, loc, anchor='topleft', antialias=True):
     text = str(text)
-    text = font.render(text, antialias, color)
+    text = text_cache.render(font, text, antialias, color)
     rect = text.get_rect()
 
     if   anchor == 'topleft'     : rect.topleft = loc
@@ -103,47 +553,296 @@ def draw_text(surface, text, font, color, loc, anchor='topleft', antialias=True)
     
     surface.blit(text, rect)
 
-   
+    return rect
+
+def blit_all(surface, blits):
+    ''' Draws a list of (image, position) pairs in one call, in order. Uses fblits where pygame has it (pygame-ce). '''
+    if hasattr(surface, 'fblits'):
+        surface.fblits(blits)
+    else:
+        surface.blits(blits, doreturn=False)
+
+def fit_animation(images, size):
+    ''' Scales one animation's frames into size, all by the same amount and bottom-centered. The crop
+        is as wide as the first frame (so a flying arrow doesn't shrink the character) and as tall as all of them. '''
+    bounds = [img.get_bounding_rect() for img in images]
+    top = min(b.top for b in bounds)
+    bottom = max(b.bottom for b in bounds)
+    window = pygame.Rect(bounds[0].left, top, bounds[0].width, bottom - top)
+
+    w, h = size
+    scale = min(w / window.width, h / window.height)
+    scaled = (max(1, round(window.width * scale)), max(1, round(window.height * scale)))
+    pos = ((w - scaled[0]) // 2, h - scaled[1])
+    frames = []
+
+    for img in images:
+        frame = pygame.Surface(size, pygame.SRCALPHA)
+        frame.blit(pygame.transform.smoothscale(img.subsurface(window), scaled), pos)
+        frames.append(frame)
+
+    return frames
+
+def build_atlas(paths, size):
+    ''' Packs every state's frames into one surface, a row facing right and then a flipped row facing
+        left per state. Returns the surface and {state: [right rects, left rects]}. '''
+    w, h = size
+    columns = max(len(files) for files in paths.values())
+    surface = pygame.Surface((columns * w, len(paths) * 2 * h), pygame.SRCALPHA)
+    index = {}
+
+    for row, (state, files) in enumerate(paths.items()):
+        frames = fit_animation([load_image(path) for path in files], size)
+        index[state] = []
+
+        for facing in range(2):
+            y = (row * 2 + facing) * h
+            rects = []
+
+            for col, frame in enumerate(frames):
+                if facing:
+                    frame = pygame.transform.flip(frame, True, False)
+
+                surface.blit(frame, (col * w, y))
+                rects.append([col * w, y, w, h])
+
+            index[state].append(rects)
+
+    return surface.convert_alpha(), index
+
+
 # Load assets
-FONT_XS = pygame.font.Font(None, 16)
-FONT_SM = pygame.font.Font(None, 32)
-FONT_MD = pygame.font.Font(None, 64)
-FONT_LG = pygame.font.Font(None, 96)
-FONT_TITLE = pygame.font.Font('fonts/The Wild Breath of Zelda.otf', 112)
+class Atlas():
+    ''' Animation frames packed into one surface. frames[state][facing] is a tuple of subsurfaces
+        of it, facing 0 right and 1 left. '''
+    def __init__(self, surface, index):
+        self.surface = surface
+        self.index = index
+        self.frames = {}
+
+        for state, facings in index.items():
+            self.frames[state] = tuple(tuple(surface.subsurface(rect) for rect in rects) for rects in facings)
+
 
-GEM_SND = load_sound('sounds/gem.ogg')
-HEAL_SND = load_sound('sounds/heal.ogg')
+class AssetManager():
+    ''' Loads images, fonts and sounds on first use and keeps them. Scaled images are also
+        cached on disk as raw RGBA, keyed by the source file's mtime, to skip decoding next launch.
+        Animation atlases are cached the same way, keyed by every frame's mtime. '''
+    CACHE_HEADER = struct.Struct('<qII')
+    ATLAS_HEADER = struct.Struct('<20sIII')
 
-HERO_IMG = load_image('images/characters/elf.png')
-BIG_ELF_IMG = load_image('images/elf_originals/3_WALK_000.png', [128, 128])
+    def __init__(self, cache_dir=ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.images = {}
+        self.atlases = {}
+        self.fonts = {}
+        self.sounds = {}
 
-STONE_IMG = load_image('images/stone/Stone (6).png', [GRID_SIZE, GRID_SIZE])
-GRASS_IMG = load_image('images/grass/Grass (5).png', [GRID_SIZE, GRID_SIZE])
-GEM_IMG = load_image('images/items/gem.png')
-POTION_IMG = load_image('images/items/potion4.png')
-GEM_ICON = load_image('images/items/gem.png', [32, 32])
-HEART_ICON = load_image('images/items/heart.png', [32, 32])
+    def image(self, path, size=None):
+        if size is not None:
+            size = tuple(size)
 
-SWORD_IMG = load_image('images/items/woodSword.png', [32, 32])
-BOOMERANG_IMG = load_image('images/items/boomerang.png', [32, 32])
+        key = (path, size)
+        img = self.images.get(key)
 
-MONSTER_IMG = load_image('images/characters/spiky_monster.png', [64, 64])
+        if img is None:
+            img = self.load_cached_image(path, size)
+            self.images[key] = img
+
+        return img
+
+    def atlas(self, animations, size):
+        ''' animations maps each state to a glob pattern for its frames. '''
+        size = tuple(size)
+        key = (tuple(animations.items()), size)
+        atlas = self.atlases.get(key)
+
+        if atlas is None:
+            atlas = self.load_cached_atlas(animations, size)
+            self.atlases[key] = atlas
+
+        return atlas
+
+    def font(self, path, size):
+        key = (path, size)
+        font = self.fonts.get(key)
+
+        if font is None:
+            font = pygame.font.Font(path, size)
+            self.fonts[key] = font
+
+        return font
+
+    def sound(self, path, volume=1.0):
+        key = (path, volume)
+        snd = self.sounds.get(key)
+
+        if snd is None:
+            snd = load_sound(path, volume)
+            self.sounds[key] = snd
+
+        return snd
+
+    def cache_file(self, path, size, ext='.rgba'):
+        name = hashlib.sha1(f'{path}|{size}'.encode()).hexdigest()
+
+        return os.path.join(self.cache_dir, name + ext)
+
+    def load_cached_image(self, path, size):
+        mtime = os.stat(path).st_mtime_ns
+        cache_file = self.cache_file(path, size)
+
+        try:
+            with open(cache_file, 'rb') as f:
+                cached_mtime, w, h = self.CACHE_HEADER.unpack(f.read(self.CACHE_HEADER.size))
+                data = f.read()
+
+            if cached_mtime == mtime and len(data) == w * h * 4:
+                return pygame.image.frombuffer(data, (w, h), 'RGBA').convert_alpha()
+        except (OSError, struct.error):
+            pass
+
+        img = load_image(path, size)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            with open(cache_file, 'wb') as f:
+                f.write(self.CACHE_HEADER.pack(mtime, img.get_width(), img.get_height()))
+                f.write(pygame.image.tostring(img, 'RGBA'))
+        except OSError:
+            pass
+
+        return img
+
+    def load_cached_atlas(self, animations, size):
+        paths = {}
+
+        for state, pattern in animations.items():
+            paths[state] = sorted(glob.glob(pattern))
+
+            if not paths[state]:
+                raise FileNotFoundError(f'no frames match {pattern}')
+
+        stamps = [(path, os.stat(path).st_mtime_ns) for files in paths.values() for path in files]
+        stamp = hashlib.sha1(repr(stamps).encode()).digest()
+        cache_file = self.cache_file(repr(animations), size, '.atlas')
+
+        try:
+            with open(cache_file, 'rb') as f:
+                cached_stamp, w, h, index_size = self.ATLAS_HEADER.unpack(f.read(self.ATLAS_HEADER.size))
+                index = json.loads(f.read(index_size))
+                data = f.read()
+
+            if cached_stamp == stamp and len(data) == w * h * 4:
+                return Atlas(pygame.image.frombuffer(data, (w, h), 'RGBA').convert_alpha(), index)
+        except (OSError, struct.error, ValueError):
+            pass
+
+        surface, index = build_atlas(paths, size)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            index_data = json.dumps(index).encode()
+
+            with open(cache_file, 'wb') as f:
+                f.write(self.ATLAS_HEADER.pack(stamp, surface.get_width(), surface.get_height(), len(index_data)))
+                f.write(index_data)
+                f.write(pygame.image.tostring(surface, 'RGBA'))
+        except OSError:
+            pass
+
+        return Atlas(surface, index)
+
+
+assets = AssetManager()
+
+# (path, size) for fonts, (path, size) for images, ({state: frames glob}, size) for atlases, path for sounds
+FONT_XS = (None, 16)
+FONT_SM = (None, 32)
+FONT_MD = (None, 64)
+FONT_LG = (None, 96)
+FONT_TITLE = ('fonts/The Wild Breath of Zelda.otf', 112)
+
+GEM_SND = 'sounds/gem.ogg'
+HEAL_SND = 'sounds/heal.ogg'
+
+HERO_ATLAS = ({'idle': 'images/elf_originals/1_IDLE_*.png',
+               'walk': 'images/elf_originals/2_WALK_*.png',
+               'run': 'images/elf_originals/3_WALK_*.png',
+               'jump': 'images/elf_originals/4_JUMP_*.png',
+               'attack': 'images/elf_originals/5_ATTACK_*.png',
+               'hurt': 'images/elf_originals/6_HURT_*.png',
+               'die': 'images/elf_originals/7_DIE_*.png'}, [54, 64])
+BIG_ELF_IMG = ('images/elf_originals/3_WALK_000.png', [128, 128])
+
+STONE_IMG = ('images/stone/Stone (6).png', [GRID_SIZE, GRID_SIZE])
+GRASS_IMG = ('images/grass/Grass (5).png', [GRID_SIZE, GRID_SIZE])
+GEM_IMG = ('images/items/gem.png', None)
+POTION_IMG = ('images/items/potion4.png', None)
+GEM_ICON = ('images/items/gem.png', [32, 32])
+HEART_ICON = ('images/items/heart.png', [32, 32])
+
+SWORD_IMG = ('images/items/woodSword.png', [32, 32])
+BOOMERANG_IMG = ('images/items/boomerang.png', [32, 32])
+
+MONSTER_ATLAS = ({'idle': 'images/characters/spiky_monster.png'}, [64, 64])
+
+
+# Animation
+class Animator():
+    ''' Picks a character's image from an Atlas by state and direction, moving to the next frame every
+        frame_ticks ticks. The frames are the atlas's subsurfaces, so changing frames allocates nothing. '''
+    def __init__(self, atlas, state='idle', frame_ticks=ANIMATION_FRAME_TICKS):
+        self.frames = atlas.frames
+        self.frame_ticks = frame_ticks
+        self.state = state
+        self.loop = True
+        self.ticks = 0
+
+    def play(self, state, loop=True):
+        ''' Starts state from its first frame. States the atlas doesn't have are ignored. '''
+        if state == self.state or state not in self.frames:
+            return
+
+        self.state = state
+        self.loop = loop
+        self.ticks = 0
+
+    def busy(self):
+        ''' Whether a state played once (like an attack) still has frames to show. '''
+        return not self.loop and self.ticks < self.frame_ticks * len(self.frames[self.state][0])
+
+    def image(self, direction):
+        frames = self.frames[self.state][1 if direction == 3 else 0]
+        n = self.ticks // self.frame_ticks
+
+        if self.loop:
+            return frames[n % len(frames)]
+
+        return frames[min(n, len(frames) - 1)]
+
+    def update(self, direction):
+        self.ticks += 1
+
+        return self.image(direction)
 
 
 # Characters
 class Player(pygame.sprite.Sprite):
-    def __init__(self, image, x, y):
+    def __init__(self, atlas, x, y):
         super().__init__()
 
-        self.image = image
-        self.rect = image.get_rect()
-        self.rect.centerx = x
-        self.rect.centery = y
-
         self.speed = PLAYER_SPEED
         self.vx = 0
         self.vy = 0
         self.direction = 0
+
+        self.animator = Animator(atlas)
+        self.image = self.animator.image(self.direction)
+        self.rect = self.image.get_rect()
+        self.rect.centerx = x
+        self.rect.centery = y
         
         self.gems = 0
         self.health = PLAYER_HEALTH
@@ -175,60 +874,119 @@ class Player(pygame.sprite.Sprite):
         self.vx = 0
         self.vy = 0
         
-    def move(self, walls):
-        self.rect.x += self.vx
-
-        hits = pygame.sprite.spritecollide(self, walls, False)
+    def move(self, world):
+        world.move_rect(self.rect, self.vx, self.vy)
 
-        for obstacle in hits:
-            if self.rect.centerx < obstacle.rect.centerx:
-                self.rect.right = obstacle.rect.left
-            elif self.rect.centerx > obstacle.rect.centerx:
-                self.rect.left = obstacle.rect.right
-
-        self.rect.y += self.vy
-
-        hits = pygame.sprite.spritecollide(self, walls, False)
-
-        for obstacle in hits:
-            if self.rect.centery < obstacle.rect.centery:
-                self.rect.bottom = obstacle.rect.top
-            elif self.rect.centery > obstacle.rect.centery:
-                self.rect.top = obstacle.rect.bottom
-
-    def use_sword(self, weapon_sprite_group):
+    def use_sword(self, projectiles):
         if self.weapon != None:
             print('Woosh')
-            weapon_sprite_group.add(self.weapon)
-            self.weapon.swing()
+            self.weapon.swing(projectiles)
+            self.animator.play('attack', loop=False)
 
-    def throw_boomerang(self, weapon_sprite_group):
+    def throw_boomerang(self, projectiles):
         if self.weapon2 != None:
             print('Fwoooo')
-            weapon_sprite_group.add(self.weapon2)
-            self.weapon2.throw()
+            self.weapon2.throw(projectiles)
+            self.animator.play('attack', loop=False)
 
     def check_items(self, items):
+        profiler.count('collision_checks', len(items))
         hits = pygame.sprite.spritecollide(self, items, True)
 
         for item in hits:
             item.apply(self)
 
-    def update(self, world):
-        self.move(world.walls)
-        self.check_items(world.items)
+    def animate(self):
+        # let an attack finish before walking or standing again
+        if not self.animator.busy():
+            if self.vx or self.vy:
+                self.animator.play('walk')
+            else:
+                self.animator.play('idle')
+
+        self.image = self.animator.update(self.direction)
+
+    def update(self, world, rooms):
+        self.move(world)
+
+        for room in rooms:
+            self.check_items(room.items)
+
+        self.animate()
 
 class Monster(pygame.sprite.Sprite):
-    def __init__(self, image, x, y):
+    def __init__(self, atlas, x, y):
         super().__init__()
 
-        self.image = image
-        self.rect = image.get_rect()
+        self.vx = 0
+        self.vy = 0
+        self.direction = 1
+        self.speed = MONSTER_SPEED
+        self.health = 3
+
+        self.animator = Animator(atlas)
+        self.image = self.animator.image(self.direction)
+        self.rect = self.image.get_rect()
         self.rect.centerx = x
         self.rect.centery = y
-        self.health = 3
+
+        # with a single frame there is nothing to animate, only the image to flip when it turns
+        self.animated = any(len(facings[0]) > 1 for facings in atlas.frames.values())
+
+    def chase(self, world):
+        ''' Heads for the center of the next cell on the way to the player. '''
+        cell = world.nav.next_cell(self.rect)
+
+        if cell is None:
+            self.vx = 0
+            self.vy = 0
+            return
+
+        x, y = world.cell_center(*cell)
+        self.vx = max(-self.speed, min(self.speed, int(x) - self.rect.centerx))
+        self.vy = max(-self.speed, min(self.speed, int(y) - self.rect.centery))
+
+        if self.vx:
+            direction = 1 if self.vx > 0 else 3
+
+            if direction != self.direction:
+                self.direction = direction
+                self.image = self.animator.image(direction)
+
+    def move(self, world):
+        world.move_rect(self.rect, self.vx, self.vy)
+
+    def animate(self):
+        if self.vx or self.vy:
+            self.animator.play('walk')
+        else:
+            self.animator.play('idle')
+
+        self.image = self.animator.update(self.direction)
+
+    def catch_up(self, world, ticks):
+        ''' Brings time-dependent state (only the animation so far) forward by ticks the monster slept
+            through. It doesn't move: while its room was asleep there was no player in it to chase. '''
+        self.animator.ticks += min(ticks, MONSTER_CATCH_UP_TICKS)
+
+    def step(self, world, ticks):
+        ''' A scheduled update standing in for the last ticks ticks. The ticks it missed, while the
+            player was in its room, are walked one at a time before the normal update. '''
+        missed = min(ticks, MONSTER_CATCH_UP_TICKS) - 1
+
+        for _ in range(missed):
+            if MONSTER_CHASE:
+                self.chase(world)
+
+            self.move(world)
+
+        if missed > 0:
+            self.animator.ticks += missed
+
+        self.update(world)
         
-    def update(self, weapons):
+    def check_weapons(self, weapons):
+        profiler.count('collision_checks', len(weapons))
         hits = pygame.sprite.spritecollide(self, weapons, False)
 
         for weapon in hits:
@@ -237,44 +995,79 @@ class Monster(pygame.sprite.Sprite):
         if self.health <= 0:
             self.kill()
 
+    def update(self, world, weapons=None):
+        if MONSTER_CHASE:
+            self.chase(world)
 
-# Tiles
-class Tile(pygame.sprite.Sprite):
-    def __init__(self, image, x, y):
-        super().__init__()
+        self.move(world)
+
+        if self.animated:
+            self.animate()
+
+        # the play scene resolves hits for every mob afterwards, so a mob that skips ticks can't dodge them
+        if weapons is not None:
+            self.check_weapons(weapons)
+
+
+# Static entities
+class StaticEntity():
+    ''' A compact stand-in for pygame.sprite.Sprite for things that never move. It has __slots__
+        instead of a __dict__ and a tuple of groups instead of a set; pygame Groups accept it as is. '''
+    __slots__ = ('image', 'rect', 'groups', 'spawn_id')
 
+    def __init__(self, image, x, y):
         self.image = image
         self.rect = image.get_rect()
         self.rect.centerx = x
         self.rect.centery = y
+        self.groups = ()
+        self.spawn_id = None
+
+    def add(self, *groups):
+        ''' Like Sprite.add. Group.add works too, but only after trying (and failing) to iterate us. '''
+        for group in groups:
+            if group not in self.groups:
+                group.add_internal(self)
+                self.add_internal(group)
+
+    def add_internal(self, group):
+        self.groups += (group,)
+
+    def remove_internal(self, group):
+        self.groups = tuple(g for g in self.groups if g is not group)
+
+    def alive(self):
+        return len(self.groups) > 0
+
+    def kill(self):
+        for group in self.groups:
+            group.remove_internal(self)
+
+        self.groups = ()
 
 
 # Items
-class Gem(pygame.sprite.Sprite):
+class Gem(StaticEntity):
+    __slots__ = ('value', 'sound')
+
     def __init__(self, image, x, y):
-        super().__init__()
+        super().__init__(image, x, y)
 
-        self.image = image
-        self.rect = image.get_rect()
-        self.rect.centerx = x
-        self.rect.centery = y
         self.value = GEM_VALUE
-        self.sound = GEM_SND
+        self.sound = assets.sound(GEM_SND)
 
     def apply(self, character):
         character.gems += self.value
         self.sound.play()
 
-class HealingPotion(pygame.sprite.Sprite):
+class HealingPotion(StaticEntity):
+    __slots__ = ('strength', 'sound')
+
     def __init__(self, image, x, y):
-        super().__init__()
+        super().__init__(image, x, y)
 
-        self.image = image
-        self.rect = image.get_rect()
-        self.rect.centerx = x
-        self.rect.centery = y
         self.strength = HEALING_POTION_STRENGTH
-        self.sound = HEAL_SND
+        self.sound = assets.sound(HEAL_SND)
 
     def apply(self, character):
         character.health += self.strength
@@ -292,35 +1085,14 @@ class Sword(pygame.sprite.Sprite):
         self.rect.centerx = x
         self.rect.centery = y
         self.owner = None
-        self.swing_timer = 0
         self.damage = 1
         
     def apply(self, character):
         self.owner = character
-        character.weapon2 = self
+        character.weapon = self
 
-    def swing(self):
-        self.swing_timer = 30
-        
-    def update(self):
-        if self.swing_timer > 0:
-            self.swing_timer -= 1
-            direction = self.owner.direction
-
-            if direction == 0:
-                self.rect.centerx = self.owner.rect.centerx
-                self.rect.bottom = self.owner.rect.top
-            elif direction == 1:
-                self.rect.left = self.owner.rect.right
-                self.rect.centery = self.owner.rect.centery
-            elif direction == 2:
-                self.rect.centerx = self.owner.rect.centerx
-                self.rect.top = self.owner.rect.bottom
-            elif direction == 3:
-                self.rect.right = self.owner.rect.left
-                self.rect.centery = self.owner.rect.centery
-        else:
-            self.kill()
+    def swing(self, projectiles):
+        projectiles.spawn(PROJECTILE_SWING, self, self.owner, SWORD_SWING_TICKS)
         
 class Boomerang(pygame.sprite.Sprite):
     def __init__(self, image, x, y):
@@ -331,103 +1103,1233 @@ class Boomerang(pygame.sprite.Sprite):
         self.rect.centerx = x
         self.rect.centery = y
         self.owner = None
-        self.throw_timer = 0
         self.damage = 1
         
     def apply(self, character):
         self.owner = character
         character.weapon2 = self
 
-    def throw(self):
-        self.throw_timer = 120
-        self.direction = self.owner.direction
-        
-        if self.direction == 0:
-            self.rect.centerx = self.owner.rect.centerx
-            self.rect.bottom = self.owner.rect.top
-        elif self.direction == 1:
-            self.rect.left = self.owner.rect.right
-            self.rect.centery = self.owner.rect.centery
-        elif self.direction == 2:
-            self.rect.centerx = self.owner.rect.centerx
-            self.rect.top = self.owner.rect.bottom
-        elif self.direction == 3:
-            self.rect.right = self.owner.rect.left
-            self.rect.centery = self.owner.rect.centery
-
-    def move(self, vx, vy):
-        self.rect.x += vx
-        self.rect.y += vy
-        
-    def update(self):
-        if self.throw_timer > 0:
-            self.throw_timer -= 1
-
-            if self.direction == 0:
-                vx, vy = [0, -5]
-            elif self.direction == 1:
-                vx, vy = [5, 0]
-            elif self.direction == 2:
-                vx, vy = [0, 5]
-            elif self.direction == 3:
-                vx, vy = [-5, 0]
-
-            self.move(vx, vy)
-        else:
-            dx = (self.owner.rect.centerx - self.rect.centerx)
-            dy = (self.owner.rect.centery - self.rect.centery)
+    def throw(self, projectiles):
+        projectiles.spawn(PROJECTILE_BOOMERANG, self, self.owner, BOOMERANG_THROW_TICKS, BOOMERANG_SPEED)
 
-            vx = 5 * dx / math.sqrt(dx ** 2 + dy ** 2)
-            vy = 5 * dy / math.sqrt(dx ** 2 + dy ** 2)
 
-            self.move(vx, vy)
-            
-            if self.rect.colliderect(self.owner.rect):
-                self.kill()
-        
-# Map
-class Map():
-    def __init__(self, file):
+# Projectiles
+PROJECTILE_SWING = 0
+PROJECTILE_BOOMERANG = 1
+PROJECTILE_ARROW = 2
+
+# indexed by direction (0 up, 1 right, 2 down, 3 left)
+DIRECTION_VECTORS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+
+class Projectile():
+    ''' One reusable slot in a ProjectilePool. '''
+    __slots__ = ('kind', 'source', 'owner', 'image', 'rect', 'damage', 'timer', 'direction', 'speed', 'active')
+
+    def __init__(self):
+        self.kind = None
+        self.source = None
+        self.owner = None
+        self.image = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.damage = 0
+        self.timer = 0
+        self.direction = 0
+        self.speed = 0
+        self.active = False
+
+
+class ProjectilePool():
+    ''' A fixed set of projectile slots that swings and throws reuse, instead of adding sprites to a
+        group and killing them again. Iterates like a Group over the projectiles in flight. '''
+    def __init__(self, size=PROJECTILE_SLOTS):
+        self.slots = [Projectile() for _ in range(size)]
+        self.free = self.slots[::-1]
+        self.active = []
+
+        # a sword or boomerang has at most one projectile out, and using it again restarts that one;
+        # arrows always take a slot of their own, so a bow can have many in flight
+        self.owned = {}
+
+    def __iter__(self):
+        return iter(self.active)
+
+    def __len__(self):
+        return len(self.active)
+
+    def sprites(self):
+        return list(self.active)
+
+    def spawn(self, kind, source, owner, ticks, speed=0):
+        ''' Launches source's projectile from in front of owner. Returns None if every slot is taken. '''
+        slot = None
+
+        if kind != PROJECTILE_ARROW:
+            slot = self.owned.get(source)
+
+        if slot is None:
+            if not self.free:
+                return None
+
+            slot = self.free.pop()
+            self.active.append(slot)
+
+            if kind != PROJECTILE_ARROW:
+                self.owned[source] = slot
+
+        slot.kind = kind
+        slot.source = source
+        slot.owner = owner
+        slot.image = source.image
+        slot.rect.size = source.rect.size
+        slot.damage = source.damage
+        slot.timer = ticks
+        slot.direction = owner.direction
+        slot.speed = speed
+        slot.active = True
+        self.place(slot, slot.direction)
+
+        return slot
+
+    def place(self, slot, direction):
+        ''' Puts slot right next to its owner on the side it faces. '''
+        rect = slot.rect
+        owner = slot.owner.rect
+
+        if direction == 0:
+            rect.centerx = owner.centerx
+            rect.bottom = owner.top
+        elif direction == 1:
+            rect.left = owner.right
+            rect.centery = owner.centery
+        elif direction == 2:
+            rect.centerx = owner.centerx
+            rect.top = owner.bottom
+        elif direction == 3:
+            rect.right = owner.left
+            rect.centery = owner.centery
+
+    def update_swing(self, slot):
+        if slot.timer > 0:
+            slot.timer -= 1
+            self.place(slot, slot.owner.direction)
+        else:
+            slot.active = False
+
+    def update_boomerang(self, slot, world):
+        if slot.timer > 0:
+            slot.timer -= 1
+            dx, dy = DIRECTION_VECTORS[slot.direction]
+            hit_x, hit_y = world.move_rect(slot.rect, dx * slot.speed, dy * slot.speed)
+
+            if hit_x or hit_y:
+                slot.timer = 0
+        else:
+            owner = slot.owner.rect
+            dx = owner.centerx - slot.rect.centerx
+            dy = owner.centery - slot.rect.centery
+            distance = math.hypot(dx, dy)
+
+            if distance == 0:
+                slot.active = False
+                return
+
+            slot.rect.x += slot.speed * dx / distance
+            slot.rect.y += slot.speed * dy / distance
+
+            if slot.rect.colliderect(owner):
+                slot.active = False
+
+    def update_arrow(self, slot, world):
+        if slot.timer > 0:
+            slot.timer -= 1
+            dx, dy = DIRECTION_VECTORS[slot.direction]
+            hit_x, hit_y = world.move_rect(slot.rect, dx * slot.speed, dy * slot.speed)
+
+            if hit_x or hit_y:
+                slot.active = False
+        else:
+            slot.active = False
+
+    def update(self, world):
+        # finished slots are dropped by compacting the list in place, keeping the rest in launch order
+        kept = 0
+
+        for slot in self.active:
+            if slot.kind == PROJECTILE_SWING:
+                self.update_swing(slot)
+            elif slot.kind == PROJECTILE_BOOMERANG:
+                self.update_boomerang(slot, world)
+            else:
+                self.update_arrow(slot, world)
+
+            if slot.active:
+                self.active[kept] = slot
+                kept += 1
+            else:
+                if self.owned.get(slot.source) is slot:
+                    del self.owned[slot.source]
+
+                slot.source = None
+                slot.owner = None
+                self.free.append(slot)
+
+        del self.active[kept:]
+
+        
+# Map files
+TILE_EMPTY = 0
+TILE_GRASS = 1
+TILE_WALL = 2
+
+ROOM_COLS = WIDTH // GRID_SIZE
+ROOM_ROWS = HEIGHT // GRID_SIZE
+
+ENTITY_SYMBOLS = 'GHSBM'
+
+# Compiled maps (.zmap) are a header, the packed tile grid, a per-room index into the
+# entity records, then the entity records themselves sorted by room.
+MAP_MAGIC = b'ZMAP'
+MAP_VERSION = 1
+MAP_HEADER = struct.Struct('<4sHHHxxIIiiI')
+MAP_ROOM_INDEX = np.dtype([('start', '<u4'), ('count', '<u4')])
+MAP_ENTITY = np.dtype([('symbol', 'S1'), ('col', '<u4'), ('row', '<u4')])
+
+
+class MapData():
+    ''' Terrain and spawn points for a map, read from either map format. '''
+    def __init__(self, tiles, entities, room_index, player):
+        self.tiles = tiles
+        self.entities = entities
+        self.room_index = room_index
+        self.player = player
+
+    def room_range(self, room_x, room_y):
+        room_rows, room_cols = self.room_index.shape
+
+        if 0 <= room_x < room_cols and 0 <= room_y < room_rows:
+            return tuple(self.room_index[room_y, room_x].tolist())
+
+        return 0, 0
+
+
+def room_grid_size(cols, rows):
+    return (cols + ROOM_COLS - 1) // ROOM_COLS, (rows + ROOM_ROWS - 1) // ROOM_ROWS
+
+def build_entity_table(symbols, cols, rows, map_cols, map_rows):
+    room_cols, room_rows = room_grid_size(map_cols, map_rows)
+    rooms = (rows // ROOM_ROWS) * room_cols + cols // ROOM_COLS
+    order = np.lexsort((cols, rows, rooms))
+
+    entities = np.zeros(len(order), MAP_ENTITY)
+    entities['symbol'] = symbols[order]
+    entities['col'] = cols[order]
+    entities['row'] = rows[order]
+
+    counts = np.bincount(rooms, minlength=room_cols * room_rows)
+    room_index = np.zeros(room_cols * room_rows, MAP_ROOM_INDEX)
+    room_index['start'] = np.cumsum(counts) - counts
+    room_index['count'] = counts
+
+    return entities, room_index.reshape(room_rows, room_cols)
+
+def parse_map_text(text):
+    lines = text.splitlines()
+    rows = len(lines)
+    cols = max([len(line) for line in lines], default=0)
+
+    grid = np.zeros((rows, cols), np.uint8)
+
+    for i, line in enumerate(lines):
+        grid[i, :len(line)] = np.frombuffer(line.encode('ascii', 'replace'), np.uint8)
+
+    tiles = np.full((rows, cols), TILE_GRASS, np.uint8)
+    tiles[grid == 0] = TILE_EMPTY
+    tiles[grid == ord('W')] = TILE_WALL
+
+    player = None
+    player_rows, player_cols = np.nonzero(grid == ord('P'))
+
+    if len(player_rows) > 0:
+        player = (int(player_cols[-1]), int(player_rows[-1]))
+
+    entity_rows, entity_cols = np.nonzero(np.isin(grid, list(ENTITY_SYMBOLS.encode())))
+    symbols = grid[entity_rows, entity_cols].view('S1')
+    entities, room_index = build_entity_table(symbols, entity_cols, entity_rows, cols, rows)
+
+    return MapData(tiles, entities, room_index, player)
+
+def read_compiled_map(path):
+    ''' Memory-maps a .zmap file; the tile grid and entity tables are views into the mapping. '''
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, room_cols, room_rows, cols, rows, player_col, player_row, count = MAP_HEADER.unpack_from(data, 0)
+
+    if magic != MAP_MAGIC or version != MAP_VERSION:
+        raise ValueError(f'{path} is not a version {MAP_VERSION} compiled map')
+
+    if room_cols != ROOM_COLS or room_rows != ROOM_ROWS:
+        raise ValueError(f'{path} was compiled for {room_cols}x{room_rows} rooms')
+
+    offset = MAP_HEADER.size
+    tiles = np.frombuffer(data, np.uint8, cols * rows, offset).reshape(rows, cols)
+    offset += tiles.nbytes
+
+    index_cols, index_rows = room_grid_size(cols, rows)
+    room_index = np.frombuffer(data, MAP_ROOM_INDEX, index_cols * index_rows, offset).reshape(index_rows, index_cols)
+    offset += room_index.nbytes
+
+    entities = np.frombuffer(data, MAP_ENTITY, count, offset)
+
+    player = None
+
+    if player_col >= 0:
+        player = (player_col, player_row)
+
+    return MapData(tiles, entities, room_index, player)
+
+def write_compiled_map(path, data):
+    rows, cols = data.tiles.shape
+    player_col, player_row = data.player if data.player is not None else (-1, -1)
+
+    with open(path, 'wb') as f:
+        f.write(MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, ROOM_COLS, ROOM_ROWS, cols, rows,
+                                player_col, player_row, len(data.entities)))
+        f.write(np.ascontiguousarray(data.tiles, np.uint8).tobytes())
+        f.write(np.ascontiguousarray(data.room_index, MAP_ROOM_INDEX).tobytes())
+        f.write(np.ascontiguousarray(data.entities, MAP_ENTITY).tobytes())
+
+def read_map(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAP_MAGIC))
+
+    if magic == MAP_MAGIC:
+        return read_compiled_map(path)
+
+    with open(path, 'r') as f:
+        return parse_map_text(f.read())
+
+def compile_map(src, dst):
+    write_compiled_map(dst, read_map(src))
+
+
+class MapTemplate():
+    ''' The parts of a map that never change while it's played, worked out once and shared by every
+        Map made from it. Maps only make their own sprites (what's picked up, mob health, player). '''
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.data = read_map(path)
+
+        # shared, so nobody gets to edit it (compiled maps are read-only mappings already)
+        self.data.tiles.flags.writeable = False
+
+        # plain memoryview indexing is several times cheaper than numpy scalar indexing
+        self.cells = memoryview(self.data.tiles if self.data.tiles.flags.c_contiguous else self.data.tiles.copy())
+        self.spawn_list = None
+
+    def spawns(self):
+        ''' Every entity in the map as (symbol, col, row), decoded the first time a Map loads them all.
+            Streaming maps never ask; they read the entity table one room at a time. '''
+        if self.spawn_list is None:
+            self.spawn_list = [(symbol.decode(), col, row) for symbol, col, row in self.data.entities.tolist()]
+
+        return self.spawn_list
+
+
+class MapTemplateCache():
+    ''' Parses each map file once, and again only if it changes on disk. '''
+    def __init__(self):
+        self.templates = {}
+
+    def get(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        template = self.templates.get(path)
+
+        if template is None or template.mtime != mtime:
+            template = MapTemplate(path, mtime)
+            self.templates[path] = template
+
+        return template
+
+    def clear(self):
+        self.templates.clear()
+
+map_templates = MapTemplateCache()
+
+
+# Map
+class Map():
+    def __init__(self, file, progress=None):
         self.file = file
+        self.progress = progress
         self.player = None
-        self.walls = pygame.sprite.Group()
         self.items = pygame.sprite.Group()
-        self.ground = pygame.sprite.Group()
         self.mobs = pygame.sprite.Group()
+        self.rooms = RoomStore()
+        self.room_cache = RoomCache(self)
+        self.nav = Navigator(self)
+        self.template = None
+        self.data = None
+        self.tiles = None
+        self.cells = None
+        self.cols = 0
+        self.rows = 0
         
-        self.load()
+        with profiler.span('Map.load'):
+            self.load()
+
+    def load(self):
+        self.load_terrain()
+        spawns = self.template.spawns()
+
+        for n, (symbol, col, row) in enumerate(spawns):
+            self.spawn(symbol, col, row)
+
+            if self.progress is not None and n % 256 == 0:
+                self.progress(n / len(spawns))
+
+    def load_terrain(self):
+        self.template = map_templates.get(self.file)
+        self.data = self.template.data
+        self.tiles = self.data.tiles
+        self.cells = self.template.cells
+        self.rows, self.cols = self.tiles.shape
+
+        if self.data.player is not None:
+            col, row = self.data.player
+            self.player = Player(assets.atlas(*HERO_ATLAS), *self.cell_center(col, row))
+
+    def cell_center(self, col, row):
+        return col * GRID_SIZE + GRID_SIZE / 2, row * GRID_SIZE + GRID_SIZE / 2
+
+    def make_entity(self, symbol, col, row):
+        x, y = self.cell_center(col, row)
+
+        if symbol == 'G':
+            return Gem(assets.image(*GEM_IMG), x, y)
+        elif symbol == 'H':
+            return HealingPotion(assets.image(*POTION_IMG), x, y)
+        elif symbol == 'S':
+            return Sword(assets.image(*SWORD_IMG), x, y)
+        elif symbol == 'B':
+            return Boomerang(assets.image(*BOOMERANG_IMG), x, y)
+        elif symbol == 'M':
+            return Monster(assets.atlas(*MONSTER_ATLAS), x, y)
+
+        return None
+
+    def add_entity(self, sprite):
+        if isinstance(sprite, Monster):
+            sprite.add(self.mobs)
+            self.rooms.add_mob(sprite)
+        else:
+            sprite.add(self.items)
+            self.rooms.add_item(sprite)
+
+    def spawn(self, symbol, col, row):
+        sprite = self.make_entity(symbol, col, row)
+
+        if sprite is not None:
+            self.add_entity(sprite)
+
+        return sprite
+
+    def stream(self, room_x, room_y, vx, vy):
+        # a plain Map is fully loaded up front
+        pass
+
+    def close(self):
+        pass
+
+    def is_solid(self, col, row):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self.cells[row, col] == TILE_WALL
+
+        return False
+
+    def solid_rects(self, rect):
+        left = rect.left // GRID_SIZE
+        right = (rect.right - 1) // GRID_SIZE
+        top = rect.top // GRID_SIZE
+        bottom = (rect.bottom - 1) // GRID_SIZE
+
+        profiler.count('collision_checks', (right - left + 1) * (bottom - top + 1))
+        hits = []
+
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                if self.is_solid(col, row):
+                    hits.append(pygame.Rect(col * GRID_SIZE, row * GRID_SIZE, GRID_SIZE, GRID_SIZE))
+
+        return hits
+
+    def move_rect(self, rect, vx, vy):
+        ''' Moves rect in place and pushes it out of any solid cells. Returns which axes were blocked. '''
+        hit_x = False
+        hit_y = False
+
+        rect.x += vx
+
+        for obstacle in self.solid_rects(rect):
+            if rect.centerx < obstacle.centerx:
+                rect.right = obstacle.left
+                hit_x = True
+            elif rect.centerx > obstacle.centerx:
+                rect.left = obstacle.right
+                hit_x = True
+
+        rect.y += vy
+
+        for obstacle in self.solid_rects(rect):
+            if rect.centery < obstacle.centery:
+                rect.bottom = obstacle.top
+                hit_y = True
+            elif rect.centery > obstacle.centery:
+                rect.top = obstacle.bottom
+                hit_y = True
+
+        return hit_x, hit_y
+
+
+class Room():
+    def __init__(self):
+        self.items = pygame.sprite.Group()
+        self.mobs = pygame.sprite.Group()
+
+        # None until the room first goes to sleep, so the first wake has nothing to catch up on
+        self.last_tick = None
+
+    def wake(self, world, tick):
+        if self.last_tick is None:
+            return
+
+        ticks = tick - self.last_tick
+
+        for mob in self.mobs:
+            mob.catch_up(world, ticks)
+
+    def sleep(self, tick):
+        self.last_tick = tick
+
+
+class RoomStore():
+    def __init__(self):
+        self.rooms = {}
+
+    def key_of(self, sprite):
+        return sprite.rect.centerx // WIDTH, sprite.rect.centery // HEIGHT
+
+    def get(self, key):
+        room = self.rooms.get(key)
+
+        if room is None:
+            room = Room()
+            self.rooms[key] = room
+
+        return room
+
+    def add_item(self, item):
+        item.add(self.get(self.key_of(item)).items)
+
+    def add_mob(self, mob):
+        mob.add(self.get(self.key_of(mob)).mobs)
+
+    def remove(self, key):
+        return self.rooms.pop(key, None)
+
+    def relocate_mobs(self, key):
+        room = self.get(key)
+
+        for mob in room.mobs.sprites():
+            new_key = self.key_of(mob)
+
+            if new_key != key:
+                room.mobs.remove(mob)
+                self.get(new_key).mobs.add(mob)
+
+
+class RoomCache():
+    def __init__(self, world, max_bytes=ROOM_CACHE_MAX_BYTES):
+        self.world = world
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.bytes_used = 0
+        self.on_miss = None
+
+    def get(self, room):
+        surface = self.surfaces.get(room)
+
+        if surface is not None:
+            self.surfaces.move_to_end(room)
+        elif self.on_miss is not None:
+            surface = self.on_miss(room)
+        else:
+            surface = self.build(room)
+            self.put(room, surface)
+
+        return surface
+
+    def put(self, room, surface):
+        self.discard(room)
+        self.surfaces[room] = surface
+        self.bytes_used += self.size_of(surface)
+        self.evict()
+
+    def discard(self, room):
+        surface = self.surfaces.pop(room, None)
+
+        if surface is not None:
+            self.bytes_used -= self.size_of(surface)
+
+    def build(self, room):
+        left = room[0] * ROOM_COLS
+        top = room[1] * ROOM_ROWS
+        tiles = self.world.tiles[top:top + ROOM_ROWS, left:left + ROOM_COLS]
+
+        grass = assets.image(*GRASS_IMG)
+        stone = assets.image(*STONE_IMG)
+        blits = []
+
+        for row, col in np.argwhere(tiles != TILE_EMPTY).tolist():
+            blits.append((grass, (col * GRID_SIZE, row * GRID_SIZE)))
+
+        for row, col in np.argwhere(tiles == TILE_WALL).tolist():
+            blits.append((stone, (col * GRID_SIZE, row * GRID_SIZE)))
+
+        surface = pygame.Surface([WIDTH, HEIGHT]).convert()
+        surface.fill(BLACK)
+        blit_all(surface, blits)
+
+        return surface
+
+    def size_of(self, surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def evict(self):
+        # always keep the newest room, even if it alone is over the cap
+        while self.bytes_used > self.max_bytes and len(self.surfaces) > 1:
+            room, surface = self.surfaces.popitem(last=False)
+            self.bytes_used -= self.size_of(surface)
+
+
+# Navigation
+class FlowField():
+    ''' A breadth-first search out from a target cell over one room's open cells. Maps each
+        reachable cell to the neighboring cell one step closer to the target. '''
+    def __init__(self, world, key, target):
+        self.key = key
+        self.target = target
+        self.steps = {target: target}
+
+        left = key[0] * ROOM_COLS
+        top = key[1] * ROOM_ROWS
+        frontier = deque([target])
+
+        while frontier:
+            col, row = frontier.popleft()
+
+            for next_col, next_row in ((col, row - 1), (col + 1, row), (col, row + 1), (col - 1, row)):
+                if not (left <= next_col < left + ROOM_COLS and top <= next_row < top + ROOM_ROWS):
+                    continue
+
+                if (next_col, next_row) in self.steps or world.is_solid(next_col, next_row):
+                    continue
+
+                self.steps[next_col, next_row] = (col, row)
+                frontier.append((next_col, next_row))
+
+
+class Navigator():
+    ''' Keeps one flow field per room toward the player's cell, rebuilt only after the player changes cells. '''
+    def __init__(self, world):
+        self.world = world
+        self.fields = {}
+
+    def field(self, key, target):
+        field = self.fields.get(key)
+
+        if field is None or field.target != target:
+            with profiler.span('FlowField'):
+                field = FlowField(self.world, key, target)
+
+            self.fields[key] = field
+
+        return field
+
+    def next_cell(self, rect):
+        ''' The cell to head for from rect's cell, or None if the player isn't in the same room or can't be reached. '''
+        col = rect.centerx // GRID_SIZE
+        row = rect.centery // GRID_SIZE
+        key = (col // ROOM_COLS, row // ROOM_ROWS)
+
+        player = self.world.player.rect
+        target = (player.centerx // GRID_SIZE, player.centery // GRID_SIZE)
+
+        if (target[0] // ROOM_COLS, target[1] // ROOM_ROWS) != key:
+            return None
+
+        return self.field(key, target).steps.get((col, row))
+
+
+# Streaming worlds
+class Chunk():
+    def __init__(self, key, sprites, surface):
+        self.key = key
+        self.sprites = sprites
+        self.surface = surface
+
+
+class ChunkLoader():
+    ''' Builds chunks for a StreamingMap on a background thread, nearest rooms first. '''
+    def __init__(self, world):
+        self.world = world
+        self.requests = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.pending = set()
+        self.count = 0
+
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def request(self, key, priority):
+        if key not in self.pending:
+            self.pending.add(key)
+            self.count += 1
+            self.requests.put((priority, self.count, key))
+
+    def work(self):
+        while True:
+            priority, count, key = self.requests.get()
+
+            if key is None:
+                break
+
+            try:
+                self.results.put(self.world.build_chunk(key))
+            except Exception as e:
+                self.results.put(e)
+
+    def poll(self):
+        chunks = []
+
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(result, Exception):
+                raise result
+
+            self.pending.discard(result.key)
+            chunks.append(result)
+
+        return chunks
+
+    def stop(self):
+        self.requests.put((-1, 0, None))
+
+
+class StreamingMap(Map):
+    ''' A Map that only keeps rooms near the player loaded. Chunks (one room's entities and
+        static surface) are read and built by a ChunkLoader; the main thread only adds them. '''
+    def __init__(self, file, progress=None):
+        self.loaded = set()
+        self.live = {}
+        self.removed = set()
+        self.last_stream = None
+        self.loader = None
+        self.blank = None
+
+        super().__init__(file, progress)
 
     def load(self):
-        with open(self.file, 'r') as f:
-            data = f.read().splitlines()
-
-        for i, line in enumerate(data):
-            for j, symbol in enumerate(line):
-                x = j * GRID_SIZE + GRID_SIZE / 2
-                y = i * GRID_SIZE + GRID_SIZE / 2
-
-                if symbol == 'P':
-                    self.player = Player(HERO_IMG, x, y)
-                elif symbol == 'W':
-                    self.walls.add(Tile(STONE_IMG, x, y))
-                elif symbol == 'G':
-                    self.items.add(Gem(GEM_IMG, x, y))
-                elif symbol == 'H':
-                    self.items.add(HealingPotion(POTION_IMG, x, y))
-                elif symbol == 'S':
-                    self.items.add(Sword(SWORD_IMG, x, y))
-                elif symbol == 'B':
-                    self.items.add(Boomerang(BOOMERANG_IMG, x, y))
-                elif symbol == 'M':
-                    self.mobs.add(Monster(MONSTER_IMG, x, y))
-
-                self.ground.add(Tile(GRASS_IMG, x, y))
+        self.load_terrain()
+
+        self.blank = pygame.Surface([WIDTH, HEIGHT]).convert()
+        self.blank.fill(BLACK)
+        self.room_cache.on_miss = self.missing_room
+        self.loader = ChunkLoader(self)
+
+        if self.player is not None:
+            self.stream(self.player.rect.centerx // WIDTH, self.player.rect.centery // HEIGHT, 0, 0)
+
+    def build_chunk(self, key):
+        ''' Runs on the loader thread. '''
+        with profiler.span('build_chunk'):
+            start, count = self.data.room_range(*key)
+            records = self.data.entities[start:start + count].tolist()
+            sprites = []
+
+            for n, (symbol, col, row) in enumerate(records):
+                if start + n not in self.removed:
+                    sprite = self.make_entity(symbol.decode(), col, row)
+
+                    if sprite is not None:
+                        sprite.spawn_id = start + n
+                        sprites.append(sprite)
+
+            return Chunk(key, sprites, self.room_cache.build(key))
+
+    def missing_room(self, key):
+        self.loader.request(key, 0)
+
+        return self.blank
+
+    def in_bounds(self, key):
+        room_rows, room_cols = self.data.room_index.shape
+
+        return 0 <= key[0] < room_cols and 0 <= key[1] < room_rows
+
+    def rooms_near(self, room_x, room_y, vx, vy):
+        ''' Rooms worth having loaded, most urgent first. '''
+        dir_x = (vx > 0) - (vx < 0)
+        dir_y = (vy > 0) - (vy < 0)
+        keys = [(room_x, room_y)]
+
+        if dir_x or dir_y:
+            for n in range(1, STREAM_RADIUS + STREAM_LOOKAHEAD + 1):
+                keys.append((room_x + dir_x * n, room_y + dir_y * n))
+
+        for dy in range(-STREAM_RADIUS, STREAM_RADIUS + 1):
+            for dx in range(-STREAM_RADIUS, STREAM_RADIUS + 1):
+                keys.append((room_x + dx, room_y + dy))
+
+        near = []
+
+        for key in keys:
+            if key not in near and self.in_bounds(key):
+                near.append(key)
+
+        return near
+
+    def add_chunk(self, chunk):
+        if chunk.key in self.loaded or not self.in_reach(chunk.key):
+            return
+
+        for sprite in chunk.sprites:
+            if sprite.spawn_id not in self.removed and sprite.spawn_id not in self.live:
+                self.live[sprite.spawn_id] = sprite
+                self.add_entity(sprite)
+
+        self.room_cache.put(chunk.key, chunk.surface)
+        self.loaded.add(chunk.key)
+
+    def in_reach(self, key):
+        if self.last_stream is None:
+            return True
+
+        room_x, room_y = self.last_stream[:2]
+
+        return max(abs(key[0] - room_x), abs(key[1] - room_y)) <= STREAM_EVICT_RADIUS
+
+    def forget_dead(self):
+        ''' Collected items and killed mobs stay gone when their room is loaded again. '''
+        for spawn_id, sprite in list(self.live.items()):
+            if not sprite.alive():
+                self.removed.add(spawn_id)
+                del self.live[spawn_id]
+
+    def evict(self, key):
+        room = self.rooms.remove(key)
+
+        if room is not None:
+            for sprite in room.items.sprites() + room.mobs.sprites():
+                sprite.kill()
+                self.live.pop(sprite.spawn_id, None)
+
+        self.room_cache.discard(key)
+        self.loaded.discard(key)
+
+    def stream(self, room_x, room_y, vx, vy):
+        for chunk in self.loader.poll():
+            self.add_chunk(chunk)
+
+        state = (room_x, room_y, (vx > 0) - (vx < 0), (vy > 0) - (vy < 0))
+
+        if state == self.last_stream:
+            return
+
+        self.last_stream = state
+
+        for priority, key in enumerate(self.rooms_near(room_x, room_y, vx, vy)):
+            if key not in self.loaded:
+                self.loader.request(key, priority)
+
+        far = [key for key in self.loaded if not self.in_reach(key)]
+
+        if far:
+            self.forget_dead()
+
+            for key in far:
+                self.evict(key)
+
+    def close(self):
+        self.loader.stop()
+
+
+# Batched entity collision
+class EntityArrays():
+    ''' Struct-of-arrays copy of a list of sprites: one array each for left, top, right and bottom, plus
+        one numeric attribute. The arrays are kept from call to call and overwritten in place. With
+        pooled=True, sizes and values are re-read every time, since the same slot may be a different weapon. '''
+    def __init__(self, attr=None, pooled=False):
+        self.attr = attr
+        self.pooled = pooled
+        self.sprites = []
+        self.resize(0)
+
+    def resize(self, count):
+        self.x = np.zeros(count, np.int32)
+        self.y = np.zeros(count, np.int32)
+        self.w = np.zeros(count, np.int32)
+        self.h = np.zeros(count, np.int32)
+        self.right = np.zeros(count, np.int32)
+        self.bottom = np.zeros(count, np.int32)
+        self.values = np.zeros(count, np.int32)
+
+    def sync(self, sprites):
+        ''' Sizes and values are only re-read when the list of sprites changes; positions every time. '''
+        if sprites != self.sprites or self.pooled:
+            if len(sprites) != len(self.x):
+                self.resize(len(sprites))
+
+            self.sprites = sprites
+            self.w[:] = [s.rect.width for s in sprites]
+            self.h[:] = [s.rect.height for s in sprites]
+
+            if self.attr is not None:
+                self.values[:] = [getattr(s, self.attr) for s in sprites]
+
+        self.x[:] = [s.rect.x for s in sprites]
+        self.y[:] = [s.rect.y for s in sprites]
+        np.add(self.x, self.w, out=self.right)
+        np.add(self.y, self.h, out=self.bottom)
+
+    def overlaps(self, other):
+        ''' len(self) x len(other) matrix of which rects overlap, by the same rule as Rect.colliderect:
+            the intervals on each axis are compared on their own, and both must overlap. '''
+        across = (self.x[:, None] < other.right[None, :]) & (other.x[None, :] < self.right[:, None])
+        down = (self.y[:, None] < other.bottom[None, :]) & (other.y[None, :] < self.bottom[:, None])
+
+        return across & down
+
+
+class BatchResolver():
+    ''' Resolves player-vs-item and weapon-vs-mob hits for every active sprite at once. '''
+    def __init__(self):
+        self.player = EntityArrays()
+        self.items = EntityArrays()
+        self.mobs = EntityArrays()
+        self.weapons = EntityArrays('damage', pooled=True)
+
+    def collect_items(self, player, items):
+        if not items:
+            return
+
+        self.player.sync([player])
+        self.items.sync(items)
+        profiler.count('collision_checks', len(items))
+
+        for i in np.flatnonzero(self.items.overlaps(self.player)[:, 0]).tolist():
+            items[i].kill()
+            items[i].apply(player)
+
+    def hit_mobs(self, mobs, weapons):
+        if not mobs or not weapons:
+            return
+
+        self.mobs.sync(mobs)
+        self.weapons.sync(weapons)
+        profiler.count('collision_checks', len(mobs) * len(weapons))
+
+        damage = self.mobs.overlaps(self.weapons).astype(np.int32) @ self.weapons.values
+
+        # health is read off the mob here rather than cached, since anything else may have changed it
+        for i in np.flatnonzero(damage).tolist():
+            mob = mobs[i]
+            mob.health -= int(damage[i])
+
+            if mob.health <= 0:
+                mob.kill()
+
+    def resolve(self, player, rooms, weapons):
+        items = []
+        mobs = []
+
+        for room in rooms:
+            items.extend(room.items)
+            mobs.extend(room.mobs)
+
+        self.collect_items(player, items)
+        self.hit_mobs(mobs, weapons.sprites())
+
+
+# Update scheduling
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+
+class Task():
+    ''' One update registered with a Scheduler. '''
+    __slots__ = ('fn', 'args', 'priority', 'rate', 'timed', 'last', 'due')
+
+    def __init__(self, fn, args, priority, rate, timed, last, due):
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.rate = rate
+        self.timed = timed
+        self.last = last
+        self.due = due
+
+    def run(self, tick):
+        if self.timed:
+            self.fn(*self.args, tick - self.last)
+        else:
+            self.fn(*self.args)
+
+        self.last = tick
+        self.due = tick + self.rate
+
+
+class Scheduler():
+    ''' Runs registered updates each tick. High priority ones run every tick, in the order they were
+        added. Low priority ones run every rate ticks, most overdue first, until the frame's budget (ms,
+        0 = none) is used up, and the rest are deferred. The most overdue one always runs, so none starve.
+        Timed tasks are passed how many ticks passed since they last ran, to make up for the ones they missed. '''
+    def __init__(self, budget=0, timer=time.perf_counter):
+        self.budget = budget / 1000
+        self.spent = 0
+        self.timer = timer
+        self.tasks = {}
+        self.tick = 0
+        self.deferred = 0
+
+    def add(self, key, fn, *args, priority=PRIORITY_LOW, rate=1, timed=False):
+        ''' Registers fn(*args) under key, or changes its priority and rate if key is already registered. '''
+        task = self.tasks.get(key)
+
+        if task is not None:
+            if rate != task.rate:
+                task.due = task.last + rate
+
+            task.priority = priority
+            task.rate = rate
+            return
+
+        # stagger the first run, so tasks added together don't all come due on the same ticks
+        self.tasks[key] = Task(fn, args, priority, rate, timed, self.tick, self.tick + 1 + len(self.tasks) % rate)
+
+    def remove(self, key):
+        self.tasks.pop(key, None)
+
+    def begin_frame(self, budget):
+        ''' Starts a new rendered frame's budget, shared by every tick stepped before the next one. '''
+        self.budget = budget / 1000
+        self.spent = 0
+
+    def run(self, tick):
+        ''' Returns how many updates that were due had to be deferred. '''
+        start = self.timer()
+        self.tick = tick
+        due = []
+
+        for task in self.tasks.values():
+            if task.priority == PRIORITY_HIGH:
+                task.run(tick)
+            elif tick >= task.due:
+                due.append(task)
+
+        due.sort(key=lambda task: task.due)
+        deadline = start + self.budget - self.spent
+        ran = 0
+
+        for task in due:
+            if ran and self.budget and self.timer() >= deadline:
+                break
+
+            task.run(tick)
+            ran += 1
+
+        self.deferred = len(due) - ran
+        self.spent += self.timer() - start
+        profiler.count('updates_deferred', self.deferred)
+
+        return self.deferred
+
+
+# HUD
+MINIMAP_RECT = pygame.Rect(16, 16, 128, 64)
+
+# minimap color of each tile code (TILE_EMPTY, TILE_GRASS, TILE_WALL); rooms not visited yet are DARK_GRAY
+MINIMAP_COLORS = np.array([BLACK, DARK_GREEN, LIGHT_GRAY], np.uint8)
+
+
+class Minimap():
+    ''' The whole tile grid drawn once, as a block of pixels per tile (or, for maps too big for that,
+        every step-th tile). Rooms are copied from it onto the shown surface as they're visited. '''
+    def __init__(self, tiles, size=MINIMAP_RECT.size):
+        rows, cols = tiles.shape
+        self.step = max(1, -(-cols // size[0]), -(-rows // size[1]))
+        self.block = max(1, min(size[0] // cols, size[1] // rows)) if self.step == 1 else 1
+
+        pixels = MINIMAP_COLORS[tiles[::self.step, ::self.step]]
+        pixels = pixels.repeat(self.block, axis=0).repeat(self.block, axis=1)
+
+        # surfarray wants (x, y), not (row, col)
+        self.layout = pygame.surfarray.make_surface(pixels.transpose(1, 0, 2))
+        self.surface = pygame.Surface(self.layout.get_size())
+        self.surface.fill(DARK_GRAY)
+        self.revealed = set()
+
+    def room_rect(self, room):
+        ''' Where a room's tiles ended up on the minimap. '''
+        left = -(-room[0] * ROOM_COLS // self.step) * self.block
+        right = -(-(room[0] + 1) * ROOM_COLS // self.step) * self.block
+        top = -(-room[1] * ROOM_ROWS // self.step) * self.block
+        bottom = -(-(room[1] + 1) * ROOM_ROWS // self.step) * self.block
+
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def reveal(self, room):
+        if room not in self.revealed:
+            rect = self.room_rect(room)
+            self.surface.blit(self.layout, rect, rect)
+            self.revealed.add(room)
+
+
+class Hud():
+    ''' Retained HUD surface; each part is only redrawn when the value it shows changes. '''
+    def __init__(self, tiles):
+        self.minimap = Minimap(tiles)
+        self.surface = pygame.Surface([WIDTH, HUD_HEIGHT])
+        self.surface.fill(BLACK)
+
+        self.room = None
+        self.gems = None
+        self.health = None
+        self.gems_rect = pygame.Rect(164, 16, 32, 32)
+        self.overlay_rect = None
+
+        draw_text(self.surface, '-- Life --', assets.font(*FONT_SM), RED, [WIDTH - 72, 16], anchor='topright', antialias=True)
+
+    def draw_minimap(self, room):
+        self.minimap.reveal(room)
+        self.surface.fill(BLACK, MINIMAP_RECT)
+        self.surface.blit(self.minimap.surface, MINIMAP_RECT)
+        pygame.draw.rect(self.surface, LIME_GREEN, self.minimap.room_rect(room).move(MINIMAP_RECT.topleft), 1)
+
+    def draw_gems(self, gems):
+        self.surface.fill(BLACK, self.gems_rect)
+        self.surface.blit(assets.image(*GEM_ICON), [164, 16])
+        text_rect = draw_text(self.surface, f'x{gems}', assets.font(*FONT_SM), WHITE, [196, 16], anchor='topleft', antialias=True)
+        self.gems_rect = text_rect.union([164, 16, 32, 32])
+
+    def draw_health(self, health):
+        self.surface.fill(BLACK, [768, 48, WIDTH - 768, 32])
+        heart = assets.image(*HEART_ICON)
+
+        for n in range(health):
+            self.surface.blit(heart, [768 + 32 * n, 48])
+
+    def update(self, player):
+        ''' Returns whether anything was redrawn. '''
+        room = (player.rect.centerx // WIDTH, player.rect.centery // HEIGHT)
+        changed = False
+
+        if room != self.room:
+            self.draw_minimap(room)
+            self.room = room
+            changed = True
+
+        if player.gems != self.gems:
+            self.draw_gems(player.gems)
+            self.gems = player.gems
+            changed = True
+
+        if player.health != self.health:
+            self.draw_health(player.health)
+            self.health = player.health
+            changed = True
+
+        return changed
+
+    def draw_overlay(self, lines):
+        ''' Profiler stats, drawn between the gem count and the hearts. Returns the rect it covers. '''
+        rect = pygame.Rect(300, 4, 440, HUD_HEIGHT - 8)
+        self.surface.fill(BLACK, rect)
+        font = assets.font(*FONT_XS)
+
+        for n, line in enumerate(lines[:rect.height // 14]):
+            self.surface.blit(font.render(line, True, LIME_GREEN), [rect.x, rect.y + 14 * n])
+
+        self.overlay_rect = rect
+
+        return rect
+
+    def clear_overlay(self):
+        ''' Blanks the stats once the overlay is turned off. Returns the rect they covered. '''
+        rect = self.overlay_rect
+        self.surface.fill(BLACK, rect)
+        self.overlay_rect = None
+
+        return rect
 
 
 # Scenes
+class Preloader():
+    ''' Builds a scene on a background thread and posts a SCENE_READY event when it's done.
+        make_scene is passed a function it can report its progress (0 to 1) to. '''
+    def __init__(self, make_scene, background=PRELOAD_SCENES):
+        self.make_scene = make_scene
+        self.progress = 0.0
+        self.scene = None
+        self.error = None
+        self.thread = None
+
+        if background:
+            self.thread = threading.Thread(target=self.build, daemon=True)
+            self.thread.start()
+        else:
+            self.build()
+
+    def report(self, progress):
+        self.progress = progress
+
+    def build(self):
+        try:
+            with profiler.span('preload'):
+                scene = self.make_scene(self.report)
+                scene.prepare()
+
+            self.scene = scene
+        except Exception as e:
+            self.error = e
+
+        self.progress = 1.0
+        pygame.event.post(pygame.event.Event(SCENE_READY))
+
+    def result(self):
+        ''' The scene, waiting for it if need be (a replay can get to SCENE_READY before the build is done). '''
+        if self.thread is not None:
+            self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.scene
+
+
 class Scene():
     def __init__(self):
+        open_window()
+
         self.next_scene = self
+        self.alpha = 1.0
+        self.dirty_rects = None
 
     def process_input(self, events, pressed_keys):
         raise NotImplementedError
@@ -438,6 +2340,14 @@ class Scene():
     def render(self):
         raise NotImplementedError
 
+    def prepare(self):
+        ''' Gets anything the first frame needs ready ahead of time. Runs on the preloader's thread. '''
+        pass
+
+    def begin_frame(self, update_budget):
+        ''' Called before the ticks of each frame with the ms they may spend on deferrable updates. '''
+        pass
+
     def terminate(self):
         self.next_scene = None
 
@@ -446,24 +2356,42 @@ class TitleScene(Scene):
     def __init__(self):
         super().__init__()
 
+        self.preloader = None
+        self.ready = False
+        self.starting = False
+
     def process_input(self, events, pressed_keys):
         for event in events:
-            if event.type == pygame.KEYDOWN:
+            if event.type == SCENE_READY:
+                self.ready = True
+            elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    self.next_scene = PlayScene()
+                    self.starting = True
 
     def update(self):
-        pass
+        # started here rather than in __init__, so a scene that preloaded this one can't take the ready event
+        if self.preloader is None:
+            self.preloader = Preloader(lambda progress: PlayScene(progress=progress))
+
+        if self.starting and self.ready:
+            self.next_scene = self.preloader.result()
 
     def render(self):
         screen.fill(BLACK)
-        draw_text(screen, TITLE, FONT_TITLE, DARK_GREEN, [WIDTH // 2, HEIGHT // 2 - 40], 'center')
-        draw_text(screen, SUBTITLE, FONT_SM, WHITE, [WIDTH // 2 - 140, HEIGHT // 2 - 22], 'topleft')
-        draw_text(screen, 'Press SPACE to begin', FONT_SM, WHITE, [WIDTH // 2, HEIGHT - GRID_SIZE], 'midbottom')
+        draw_text(screen, TITLE, assets.font(*FONT_TITLE), DARK_GREEN, [WIDTH // 2, HEIGHT // 2 - 40], 'center')
+        draw_text(screen, SUBTITLE, assets.font(*FONT_SM), WHITE, [WIDTH // 2 - 140, HEIGHT // 2 - 22], 'topleft')
 
-        rect = BIG_ELF_IMG.get_rect()
+        if self.starting and not self.ready:
+            progress = self.preloader.progress if self.preloader is not None else 0
+            pygame.draw.rect(screen, WHITE, [WIDTH // 2 - 150, HEIGHT - GRID_SIZE - 24, 300, 24], 2)
+            pygame.draw.rect(screen, WHITE, [WIDTH // 2 - 146, HEIGHT - GRID_SIZE - 20, int(292 * progress), 16])
+        else:
+            draw_text(screen, 'Press SPACE to begin', assets.font(*FONT_SM), WHITE, [WIDTH // 2, HEIGHT - GRID_SIZE], 'midbottom')
+
+        big_elf = assets.image(*BIG_ELF_IMG)
+        rect = big_elf.get_rect()
         rect.center = [WIDTH //2, HEIGHT // 2 + 128]
-        screen.blit(BIG_ELF_IMG, rect)
+        screen.blit(big_elf, rect)
         
         pygame.draw.rect(screen, DARK_GREEN, [64, 64, WIDTH - 128, HEIGHT - 64], 16)
         
@@ -472,35 +2400,57 @@ class TitleScene(Scene):
 
 
 class PlayScene(Scene):
-    def __init__(self):
+    def __init__(self, map_file=MAP_FILE, streaming=STREAM_WORLD, progress=None):
         super().__init__()
         
-        self.world = Map(MAP_FILE)
+        if streaming:
+            self.world = StreamingMap(map_file, progress)
+        else:
+            self.world = Map(map_file, progress)
+
         self.player = self.world.player
-        self.walls = self.world.walls
         self.items = self.world.items
-        self.ground = self.world.ground
         self.mobs = self.world.mobs
 
-        self.weapons = pygame.sprite.Group()
+        self.projectiles = ProjectilePool()
+        self.batch = BatchResolver()
+
+        self.scheduler = Scheduler()
+        self.scheduler.add(self.player, self.update_player, priority=PRIORITY_HIGH)
+        self.scheduler.add(self.projectiles, self.projectiles.update, self.world, priority=PRIORITY_HIGH)
+        self.scheduled_mobs = []
 
-        self.all_sprites = pygame.sprite.Group()
-        self.all_sprites.add(self.player, self.walls, self.items, self.mobs)
+        self.room_cache = self.world.room_cache
+
+        self.ticks = 0
+        self.active_keys = []
 
         self.set_start_offset()
+        self.prev_offset = (self.offset_x, self.offset_y)
+        self.prev_positions = {}
+
+        self.drawn = {}
+        self.drawn_rooms = []
+        self.drawn_offset = None
+
+        self.strip = None
+        self.strip_key = None
 
         self.main = pygame.Surface([WIDTH, HEIGHT])
-        self.hud = pygame.Surface([WIDTH, HUD_HEIGHT])
+        self.hud = Hud(self.world.tiles)
         
     def process_input(self, events, pressed):
         for event in events:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_TAB:
+                    self.world.close()
                     self.next_scene = EndScene()
                 elif event.key == pygame.K_g:
-                    self.player.use_sword(self.weapons)
+                    self.player.use_sword(self.projectiles)
                 elif event.key == pygame.K_h:
-                    self.player.throw_boomerang(self.weapons)
+                    self.player.throw_boomerang(self.projectiles)
+                elif event.key == pygame.K_F3 and profiler.enabled:
+                    profiler.show_overlay = not profiler.show_overlay
 
         if pressed[CONTROLS['up']]:
             self.player.go_up()
@@ -547,53 +2497,283 @@ class PlayScene(Scene):
             self.offset_x = room_x * WIDTH
             self.offset_y = room_y * HEIGHT
             
+    def active_rooms(self):
+        ''' The current room, plus the one being scrolled away from during a transition. '''
+        room_x = self.player.rect.centerx // WIDTH
+        room_y = self.player.rect.centery // HEIGHT
+        keys = [(room_x, room_y)]
+
+        if self.transitioning and (self.last_room_x, self.last_room_y) != (room_x, room_y):
+            keys.append((self.last_room_x, self.last_room_y))
+
+        return keys
+
+    def visible_rooms(self, offset_x, offset_y):
+        first_x = offset_x // WIDTH
+        first_y = offset_y // HEIGHT
+        last_x = (offset_x + WIDTH - 1) // WIDTH
+        last_y = (offset_y + HEIGHT - 1) // HEIGHT
+
+        return [(x, y) for y in range(first_y, last_y + 1) for x in range(first_x, last_x + 1)]
+
+    def update_active_rooms(self):
+        keys = self.active_keys
+        self.active_keys = self.active_rooms()
+
+        for key in keys:
+            if key not in self.active_keys:
+                self.world.rooms.get(key).sleep(self.ticks)
+
+        for key in self.active_keys:
+            if key not in keys:
+                self.world.rooms.get(key).wake(self.world, self.ticks)
+
+    def moving_sprites(self):
+        sprites = [self.player]
+        sprites.extend(self.projectiles)
+
+        for key in self.active_keys:
+            sprites.extend(self.world.rooms.get(key).mobs)
+
+        return sprites
+
+    def remember_positions(self):
+        self.prev_offset = (self.offset_x, self.offset_y)
+        self.prev_positions = {s: s.rect.topleft for s in self.moving_sprites()}
+
+    def lerp(self, start, end):
+        return int(start + (end - start) * self.alpha)
+
+    def view_offset(self):
+        if self.alpha >= 1:
+            return self.offset_x, self.offset_y
+
+        return self.lerp(self.prev_offset[0], self.offset_x), self.lerp(self.prev_offset[1], self.offset_y)
+
+    def view_position(self, sprite):
+        prev = self.prev_positions.get(sprite)
+
+        if prev is None or self.alpha >= 1:
+            return sprite.rect.x, sprite.rect.y
+
+        return self.lerp(prev[0], sprite.rect.x), self.lerp(prev[1], sprite.rect.y)
+
     def update(self):
+        if INTERPOLATE:
+            self.remember_positions()
+
+        self.ticks += 1
         self.calculate_offset()
 
-        self.all_sprites.add(self.weapons)
-        
-        self.player.update(self.world)
-        self.weapons.update()
-        self.mobs.update(self.weapons)
+        room_x = self.player.rect.centerx // WIDTH
+        room_y = self.player.rect.centery // HEIGHT
+        self.world.stream(room_x, room_y, self.player.vx, self.player.vy)
 
-    def render(self):
-        screen.fill(BLACK)
+        self.update_active_rooms()
 
-        ''' hud '''
-        self.hud.fill(BLACK)
-        pygame.draw.rect(self.hud, LIGHT_GRAY, [16, 16, 128, 64])
-        x = 16 + self.player.rect.centerx // WIDTH * 8
-        y = 16 + self.player.rect.centery // HEIGHT * 8
-        pygame.draw.rect(self.hud, LIME_GREEN, [x, y, 8, 8])
-        
-        self.hud.blit(GEM_ICON, [164, 16])
-        draw_text(self.hud, f'x{self.player.gems}', FONT_SM, WHITE, [196, 16], anchor='topleft', antialias=True)
+        rooms = [self.world.rooms.get(key) for key in self.active_keys]
+
+        self.schedule_mobs(rooms)
+        self.scheduler.run(self.ticks)
+
+        if ENTITY_BACKEND == 'arrays':
+            self.batch.resolve(self.player, rooms, self.projectiles)
+        else:
+            for room in rooms:
+                for mob in room.mobs.sprites():
+                    mob.check_weapons(self.projectiles)
+
+        for key in self.active_keys:
+            self.world.rooms.relocate_mobs(key)
+
+    def begin_frame(self, update_budget):
+        self.scheduler.begin_frame(update_budget)
+
+    def update_player(self):
+        if ENTITY_BACKEND == 'arrays':
+            # items are collected by the batch resolver afterwards
+            self.player.move(self.world)
+            self.player.animate()
+        else:
+            self.player.update(self.world, [self.world.rooms.get(key) for key in self.active_keys])
+
+    def schedule_mobs(self, rooms):
+        ''' Keeps the scheduler in step with the mobs in the active rooms. The ones near the player
+            update every tick and the rest every MONSTER_FAR_RATE ticks. '''
+        mobs = []
+
+        for room in rooms:
+            mobs.extend(room.mobs)
+
+        current = set(mobs)
+
+        for mob in self.scheduled_mobs:
+            if mob not in current:
+                self.scheduler.remove(mob)
+
+        x, y = self.player.rect.center
+
+        for mob in mobs:
+            if math.hypot(mob.rect.centerx - x, mob.rect.centery - y) <= MONSTER_NEAR_DISTANCE:
+                self.scheduler.add(mob, mob.step, self.world, priority=PRIORITY_HIGH, timed=True)
+            else:
+                self.scheduler.add(mob, mob.step, self.world, rate=MONSTER_FAR_RATE, timed=True)
+
+        self.scheduled_mobs = mobs
+
+    def visible_sprites(self, keys, offset_x, offset_y):
+        ''' Maps each sprite on screen in the given rooms to the (image, rect) it is drawn with. The
+            order is the draw order, one layer after another: items < mobs < player < weapons. '''
+        rooms = [self.world.rooms.get(key) for key in keys]
+        layers = [room.items for room in rooms] + [room.mobs for room in rooms] + [[self.player], self.projectiles]
+        interpolate = self.alpha < 1
+        drawn = {}
+
+        for layer in layers:
+            for s in layer:
+                if interpolate:
+                    x, y = self.view_position(s)
+                else:
+                    x, y = s.rect.topleft
+
+                x -= offset_x
+                y -= offset_y
+
+                if -GRID_SIZE < x < WIDTH and -GRID_SIZE < y < HEIGHT:
+                    drawn[s] = (s.image, pygame.Rect((x, y), s.image.get_size()))
+
+        return drawn
+
+    def dirty_regions(self, drawn):
+        ''' Where sprites were drawn last frame or will be this frame, for any sprite that changed. '''
+        dirty = []
+
+        for s, (image, rect) in drawn.items():
+            old = self.drawn.get(s)
+
+            if old is None or old[1] != rect or old[0] is not image:
+                dirty.append(rect)
+
+                if old is not None:
+                    dirty.append(old[1])
+
+        for s, (image, rect) in self.drawn.items():
+            if s not in drawn:
+                dirty.append(rect)
+
+        bounds = self.main.get_rect()
+
+        return [rect.clip(bounds) for rect in dirty if rect.colliderect(bounds)]
+
+    def transition_strip(self, rooms):
+        ''' While scrolling between two rooms, both are composed once into a single strip surface. '''
+        current = (self.player.rect.centerx // WIDTH, self.player.rect.centery // HEIGHT)
+        last = (self.last_room_x, self.last_room_y)
+
+        if not self.transitioning or any(key not in (last, current) for key, surface in rooms):
+            self.strip = None
+            self.strip_key = None
+            return None
+
+        surfaces = (self.room_cache.get(last), self.room_cache.get(current))
+        key = (last, current, surfaces)
+
+        if self.strip_key is None or self.strip_key[:2] != key[:2] or any(a is not b for a, b in zip(self.strip_key[2], surfaces)):
+            left = min(last[0], current[0])
+            top = min(last[1], current[1])
+            strip = pygame.Surface([(abs(last[0] - current[0]) + 1) * WIDTH, (abs(last[1] - current[1]) + 1) * HEIGHT]).convert()
+
+            for room, surface in zip([last, current], surfaces):
+                strip.blit(surface, [(room[0] - left) * WIDTH, (room[1] - top) * HEIGHT])
+
+            self.strip = (strip, left * WIDTH, top * HEIGHT)
+            self.strip_key = key
+
+        return self.strip
 
-        draw_text(self.hud, '-- Life --', FONT_SM, RED, [WIDTH - 72, 16], anchor='topright', antialias=True)
-        for n in range(self.player.health):
-            self.hud.blit(HEART_ICON, [768 + 32 * n, 48])
+    def draw_world(self, background, offset_x, offset_y, sprites, rects, clip=None):
+        ''' Draws the ground, then sprites (a draw-ordered list of (image, rect), with rects
+            their rects alone) in one batch. With a clip, only the sprites touching it. '''
+        self.main.set_clip(clip)
+
+        for surface, x, y in background:
+            self.main.blit(surface, (x - offset_x, y - offset_y))
+
+        if clip is not None:
+            sprites = [sprites[i] for i in clip.collidelistall(rects)]
+
+        blit_all(self.main, sprites)
+        profiler.count('sprites_drawn', len(sprites))
+
+        self.main.set_clip(None)
+
+    def render(self):
+        ''' hud '''
+        hud_changed = self.hud.update(self.player)
 
         ''' world '''
-        for s in self.ground:
-            x = s.rect.x - self.offset_x
-            y = s.rect.y - self.offset_y
+        offset_x, offset_y = self.view_offset()
+        keys = self.visible_rooms(offset_x, offset_y)
+        rooms = [(key, self.room_cache.get(key)) for key in keys]
+        drawn = self.visible_sprites(keys, offset_x, offset_y)
+        sprites = list(drawn.values())
+        rects = [rect for image, rect in sprites]
 
-            if -GRID_SIZE < x < WIDTH and -GRID_SIZE < y < HEIGHT:
-                self.main.blit(s.image, [x, y])
+        strip = self.transition_strip(rooms)
 
-        for s in self.all_sprites:
-            x = s.rect.x - self.offset_x
-            y = s.rect.y - self.offset_y
+        if strip is not None:
+            background = [strip]
+        else:
+            background = [(surface, key[0] * WIDTH, key[1] * HEIGHT) for key, surface in rooms]
 
-            if -GRID_SIZE < x < WIDTH and -GRID_SIZE < y < HEIGHT:
-                self.main.blit(s.image, [x, y])
+        full = (not DIRTY_RECTS or (offset_x, offset_y) != self.drawn_offset or
+                any(a[1] is not b[1] for a, b in zip(rooms, self.drawn_rooms)))
 
-        self.weapons.draw(self.main)
+        if not full:
+            dirty = self.dirty_regions(drawn)
+            full = len(dirty) > DIRTY_RECT_LIMIT
+
+        if full:
+            self.draw_world(background, offset_x, offset_y, sprites, rects)
+            screen.blit(self.hud.surface, [0, 0])
+            screen.blit(self.main, [0, HUD_HEIGHT])
+            self.dirty_rects = None
+        else:
+            self.dirty_rects = []
+
+            for rect in dirty:
+                self.draw_world(background, offset_x, offset_y, sprites, rects, rect)
+                screen.blit(self.main, rect.move(0, HUD_HEIGHT), rect)
+                self.dirty_rects.append(rect.move(0, HUD_HEIGHT))
+
+            if hud_changed:
+                screen.blit(self.hud.surface, [0, 0])
+                self.dirty_rects.append(pygame.Rect(0, 0, WIDTH, HUD_HEIGHT))
+
+        if profiler.show_overlay:
+            lines = ['phase              p50      p95      p99'] + profiler.summary()
+            rect = self.hud.draw_overlay(lines)
+        elif self.hud.overlay_rect is not None:
+            rect = self.hud.clear_overlay()
+        else:
+            rect = None
+
+        if rect is not None:
+            screen.blit(self.hud.surface, rect, rect)
+
+            if self.dirty_rects is not None:
+                self.dirty_rects.append(rect)
+
+        self.drawn = drawn
+        self.drawn_rooms = rooms
+        self.drawn_offset = (offset_x, offset_y)
+
+    def prepare(self):
+        for key in self.visible_rooms(self.offset_x, self.offset_y):
+            self.room_cache.get(key)
 
-        screen.blit(self.hud, [0, 0])
-        screen.blit(self.main, [0, HUD_HEIGHT])
-        
     def terminate(self):
+        self.world.close()
         self.next_scene = None
 
 
@@ -601,26 +2781,49 @@ class EndScene(Scene):
     def __init__(self):
         super().__init__()
 
+        self.preloader = None
+        self.ready = False
+        self.restarting = False
+
     def process_input(self, events, pressed_keys):
         for event in events:
-            if event.type == pygame.KEYDOWN:
+            if event.type == SCENE_READY:
+                self.ready = True
+            elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    self.next_scene = TitleScene()
+                    self.restarting = True
 
     def update(self):
-        pass
+        if self.preloader is None:
+            self.preloader = Preloader(lambda progress: TitleScene())
+
+        if self.restarting and self.ready:
+            self.next_scene = self.preloader.result()
 
     def render(self):
         screen.fill(BLACK)
-        draw_text(screen, 'End Scene', FONT_LG, WHITE, [WIDTH // 2, HEIGHT // 2], 'center')
+        draw_text(screen, 'End Scene', assets.font(*FONT_LG), WHITE, [WIDTH // 2, HEIGHT // 2], 'center')
 
     def terminate(self):
         self.next_scene = None
 
 # Game
 class Game():
-    def __init__(self):
-        self.active_scene = TitleScene()
+    def __init__(self, scene=None, clock=clock, input_source=None, render=True, update_budget=None):
+        if scene is None:
+            scene = TitleScene()
+
+        # a wall-clock budget only makes sense live; anything meant to play back the same gets none
+        if update_budget is None:
+            live = isinstance(clock, GameClock) and not isinstance(input_source, (InputRecorder, InputReplay))
+            update_budget = UPDATE_BUDGET if live else 0
+
+        self.active_scene = scene
+        self.clock = clock
+        self.input_source = input_source
+        self.render = render
+        self.update_budget = update_budget
+        self.ticks = 0
 
     def is_quit_event(self, event, pressed_keys):
         x_out = event.type == pygame.QUIT
@@ -629,32 +2832,121 @@ class Game():
 
         return x_out or (ctrl and q)
 
-    def run(self):
-        while self.active_scene != None:
-            # event handling
-            pressed_keys = pygame.key.get_pressed()
-            filtered_events = []
+    def read_input(self):
+        if self.input_source is not None:
+            return self.input_source.poll()
 
-            for event in pygame.event.get():
-                if self.is_quit_event(event, pressed_keys):
-                    self.active_scene.terminate()
-                else:
-                    filtered_events.append(event)
+        return pygame.event.get(), pygame.key.get_pressed()
+
+    def step(self):
+        ''' Runs one fixed simulation step. Returns False once the input source runs dry. '''
+        with profiler.span('input'):
+            state = self.read_input()
+
+        if state is None:
+            return False
+
+        # event handling
+        events, pressed_keys = state
+        filtered_events = []
 
-            # game logic
+        for event in events:
+            if self.is_quit_event(event, pressed_keys):
+                self.active_scene.terminate()
+            else:
+                filtered_events.append(event)
+
+        # game logic
+        with profiler.span('process_input'):
             self.active_scene.process_input(filtered_events, pressed_keys)
+
+        with profiler.span('update'):
             self.active_scene.update()
-            self.active_scene.render()
-            self.active_scene = self.active_scene.next_scene
 
-            # update and tick
-            pygame.display.update()
-            clock.tick(FPS)
+        self.active_scene = self.active_scene.next_scene
+        self.ticks += 1
+
+        return True
+
+    def run(self, max_ticks=None):
+        lag = 0
+        skipped = 0
+        last = self.clock.now()
+        running = True
+
+        while running and self.active_scene != None:
+            now = self.clock.now()
+            lag += now - last
+            last = now
+
+            # catch up on simulation steps, but never more than MAX_STEPS_PER_FRAME per frame
+            steps = 0
+            self.active_scene.begin_frame(self.update_budget)
+
+            while lag >= STEP_TIME and steps < MAX_STEPS_PER_FRAME and self.active_scene != None:
+                if max_ticks is not None and self.ticks >= max_ticks:
+                    running = False
+                    break
+
+                if not self.step():
+                    running = False
+                    break
+
+                lag -= STEP_TIME
+                steps += 1
+
+            if not running or self.active_scene == None:
+                break
+
+            behind = lag >= STEP_TIME
+
+            if behind and steps == MAX_STEPS_PER_FRAME:
+                # too far behind to catch up, so let the game slow down instead of spiraling
+                lag = lag % STEP_TIME
+
+            # render, skipping frames under load and frames where nothing changed
+            if not self.render or (steps == 0 and not INTERPOLATE):
+                pass
+            elif behind and skipped < MAX_FRAME_SKIP:
+                skipped += 1
+            else:
+                if INTERPOLATE:
+                    self.active_scene.alpha = lag / STEP_TIME
+
+                with profiler.span('render'):
+                    self.active_scene.render()
+
+                with profiler.span('display'):
+                    if self.active_scene.dirty_rects is None:
+                        pygame.display.update()
+                    else:
+                        pygame.display.update(self.active_scene.dirty_rects)
+
+                skipped = 0
+
+            with profiler.span('tick'):
+                self.clock.tick(RENDER_FPS)
+
+            profiler.end_frame()
+
+        return self.ticks
 
     def quit(self):
+        if profiler.enabled:
+            profiler.export()
+
         pygame.quit()
 
 if __name__ == "__main__":
-    g = Game()
+    recorder = None
+
+    if RECORD_FILE:
+        recorder = InputRecorder(RECORD_FILE)
+
+    g = Game(input_source=recorder)
     g.run()
+
+    if recorder is not None:
+        recorder.close()
+
     g.quit()